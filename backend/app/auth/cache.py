@@ -0,0 +1,11 @@
+from app.core.cache import LRUCache
+from app.core.config import settings
+
+# UserBase by user id, read on every authenticated request
+user_cache = LRUCache(
+    maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS
+)
+
+
+def invalidate_user(user_id: str) -> None:
+    user_cache.pop(user_id)
@@ -5,7 +5,11 @@ from datetime import datetime
 from odmantic import Field, Model, EmbeddedModel, ObjectId
 from pydantic import EmailStr, BaseModel, validator
 
-from app.auth.utils import password_match, verify_password, get_password_hash
+from app.auth.utils import (
+    password_match,
+    verify_password_async,
+    get_password_hash_async,
+)
 from app.core.model import BaseModelClass
 
 
@@ -65,11 +69,11 @@ class UserInCreate(UserInLogin):
         password_match
     )
 
-    def check_password(self, password: str) -> bool:
-        return verify_password(password, self.password)
+    async def check_password(self, password: str) -> bool:
+        return await verify_password_async(password, self.password)
 
-    def change_password(self, password: str) -> str:
-        self.password = get_password_hash(password)
+    async def change_password(self, password: str) -> str:
+        self.password = await get_password_hash_async(password)
 
 
 class UserInResponse(BaseModel):
@@ -95,9 +99,20 @@ class UserTokenInDB(Model):
         collection = "user_token"
 
 
+class RevokedTokenInDB(Model):
+    jti: str = Field(unique=True)
+    user_id: str
+    revoked_at: datetime
+    expired_at: datetime  # expiry of the revoked token itself
+
+    class Config:
+        collection = "revoked_token"
+
+
 class ResetInDB(Model):
     email: EmailStr = Field(unique=True)
     token: str = Field(unique=True)
+    expired_at: datetime
 
     class Config:
         collection = "reset_password"
@@ -112,6 +127,7 @@ class ResetSchema(BaseModel):
 class VerifyInDB(Model):
     email: EmailStr = Field(unique=True)
     token: str = Field(unique=True)
+    expired_at: datetime
 
     class Config:
         collection = "user_verify"
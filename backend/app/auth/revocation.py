@@ -0,0 +1,105 @@
+import time
+import asyncio
+import logging
+import datetime
+from typing import Dict, Optional
+
+from odmantic import AIOEngine
+
+from app.auth.models import RevokedTokenInDB
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RevocationList:
+    """In-memory set of revoked token ids, synced from Mongo.
+
+    Checking a token is a dict lookup. Revocations made by this worker are
+    visible at once, the others after at most one sync interval.
+    """
+
+    def __init__(self) -> None:
+        # jti -> token expiry as a unix timestamp
+        self._revoked: Dict[str, float] = {}
+        self._synced_at: Optional[datetime.datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped: Optional[asyncio.Event] = None
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        return jti is not None and jti in self._revoked
+
+    def add(self, jti: str, expires_at: float) -> None:
+        self._revoked[jti] = expires_at
+
+    def prune(self) -> None:
+        """Forget revoked tokens that expired anyway"""
+        now = time.time()
+        for jti in [jti for jti, exp in self._revoked.items() if exp <= now]:
+            del self._revoked[jti]
+
+    async def revoke(
+        self, engine: AIOEngine, jti: str, user_id: str, expires_at: float
+    ) -> None:
+        """Record a revoked token, until it would have expired"""
+        self.add(jti, expires_at)
+        await engine.get_collection(RevokedTokenInDB).update_one(
+            {"jti": jti},
+            {
+                "$set": {
+                    "user_id": user_id,
+                    "revoked_at": datetime.datetime.utcnow(),
+                    "expired_at": datetime.datetime.utcfromtimestamp(expires_at),
+                }
+            },
+            upsert=True,
+        )
+
+    async def sync(self, engine: AIOEngine) -> None:
+        """Load revocations recorded since the last sync, by any worker"""
+        now = datetime.datetime.utcnow()
+        query = {"expired_at": {"$gt": now}}
+        if self._synced_at is not None:
+            # overlap one interval, covers clock skew and in-flight writes
+            query["revoked_at"] = {
+                "$gte": self._synced_at
+                - datetime.timedelta(seconds=settings.REVOCATION_SYNC_SECONDS)
+            }
+        cursor = engine.get_collection(RevokedTokenInDB).find(
+            query, {"jti": 1, "expired_at": 1}
+        )
+        async for document in cursor:
+            expires_at = document["expired_at"].replace(tzinfo=datetime.timezone.utc)
+            self.add(document["jti"], expires_at.timestamp())
+        self._synced_at = now
+        self.prune()
+
+    def start(self, engine: AIOEngine) -> None:
+        # created here, bound to the loop of the running worker
+        self._stopped = asyncio.Event()
+        self._task = asyncio.create_task(self._run(engine))
+
+    async def stop(self) -> None:
+        if self._task:
+            self._stopped.set()
+            await self._task
+
+    async def _run(self, engine: AIOEngine) -> None:
+        while not self._stopped.is_set():
+            try:
+                await self.sync(engine)
+            except Exception:
+                logger.exception("Revocation list sync failed")
+            try:
+                await asyncio.wait_for(
+                    self._stopped.wait(), settings.REVOCATION_SYNC_SECONDS
+                )
+            except asyncio.TimeoutError:
+                pass
+
+
+# revoked access tokens, checked on every authenticated request
+revocation_list = RevocationList()
@@ -8,12 +8,12 @@ from fastapi import (
     Response,
     APIRouter,
     HTTPException,
-    BackgroundTasks,
 )
 from odmantic import AIOEngine
 from fastapi.responses import RedirectResponse
 
-from app.auth.utils import get_password_hash
+from app.auth.cache import invalidate_user
+from app.auth.utils import get_password_hash_async
 from app.auth.models import (
     UserBase,
     ResetInDB,
@@ -27,6 +27,7 @@ from app.auth.models import (
 from app.auth.services import (
     create_user,
     authenticate,
+    revoke_tokens,
     generate_token,
     send_verify_email,
     send_reset_password,
@@ -34,6 +35,7 @@ from app.auth.services import (
     update_user_profile,
 )
 from app.core.security import get_current_user_authorizer
+from app.core.ratelimit import rate_limit
 from app.core.services import get_db
 from app.auth.selectors import get_user_reset, get_verify_email, get_user_by_email
 
@@ -44,9 +46,9 @@ router = APIRouter(prefix="/auth")
     "/register",
     response_model=UserInResponse,
     status_code=HTTPStatus.CREATED,
+    dependencies=[Depends(rate_limit("register"))],
 )
 async def register(
-    background_tasks: BackgroundTasks,
     user: UserInCreate = Body(..., embed=True),
     engine: AIOEngine = Depends(get_db),
 ) -> Any:
@@ -59,7 +61,7 @@ async def register(
 
     new_user = await create_user(engine, user)
     if new_user:
-        await send_verify_email(new_user.email, engine, background_tasks)
+        await send_verify_email(new_user, engine)
         return UserInResponse(user=new_user)
     raise HTTPException(
         status_code=HTTPStatus.BAD_REQUEST, detail="Something went wrong / Bad request"
@@ -88,10 +90,16 @@ async def verify(
     async with engine.session() as session:
         await session.save(user)
         await session.delete(verify_email)
+    invalidate_user(str(user.id))
     return RedirectResponse(redirect_url)
 
 
-@router.post("/login", response_model=UserInLoginResponse, status_code=HTTPStatus.OK)
+@router.post(
+    "/login",
+    response_model=UserInLoginResponse,
+    status_code=HTTPStatus.OK,
+    dependencies=[Depends(rate_limit("login"))],
+)
 async def login(
     data: UserInLogin,
     response: Response,
@@ -122,17 +130,29 @@ async def refresh_token(
 
 
 @router.post("/logout", status_code=HTTPStatus.OK)
-async def logout(response: Response) -> Any:
-    """Log out authenticated user, Remove cookies"""
+async def logout(
+    request: Request,
+    response: Response,
+    engine: AIOEngine = Depends(get_db),
+) -> Any:
+    """Log out authenticated user, Revoke tokens and remove cookies"""
+    await revoke_tokens(
+        engine,
+        request.cookies.get("access_token"),
+        request.cookies.get("refresh_token"),
+    )
     response.delete_cookie(key="access_token")
     response.delete_cookie(key="refresh_token")
     return {"message": "success"}
 
 
-@router.post("/recover_password", status_code=HTTPStatus.OK)
+@router.post(
+    "/recover_password",
+    status_code=HTTPStatus.OK,
+    dependencies=[Depends(rate_limit("recover_password"))],
+)
 async def recover_password(
     email: str,
-    background_tasks: BackgroundTasks,
     engine: AIOEngine = Depends(get_db),
 ) -> Any:
     """Forget password"""
@@ -142,7 +162,7 @@ async def recover_password(
             status_code=HTTPStatus.BAD_REQUEST,
             detail="The user with this username does not exist in the system.",
         )
-    await send_reset_password(engine, user.email, background_tasks)
+    await send_reset_password(engine, user)
     return {"message": "Password recovery email sent"}
 
 
@@ -166,11 +186,12 @@ async def reset_password(
             detail="The user with this username does not exist in the system.",
         )
 
-    hashed_password = get_password_hash(data.password)
+    hashed_password = await get_password_hash_async(data.password)
     user.password = hashed_password
     async with engine.session() as session:
         await session.save(user)
         await session.delete(ResetInDB, ResetInDB.token == data.token)
+    invalidate_user(str(user.id))
     return {"message": "Password updated successfully"}
 
 
@@ -1,8 +1,10 @@
 from typing import Optional
+from datetime import datetime
 
 from odmantic import AIOEngine, ObjectId
 from pydantic import EmailStr
 
+from app.auth.cache import user_cache
 from app.auth.models import User, UserBase, ResetInDB, VerifyInDB, UserTokenInDB
 
 
@@ -23,9 +25,26 @@ async def get_user_by_id(engine: AIOEngine, id: str) -> Optional[User]:
     return None
 
 
+async def get_cached_user_by_id(engine: AIOEngine, id: str) -> Optional[UserBase]:
+    """Get user by id, served from the user cache when warm"""
+    cached_user = user_cache.get(id)
+    if cached_user:
+        return cached_user
+    user = await get_user_by_id(engine, id)
+    if not user:
+        return None
+    cached_user = UserBase(**user.dict())
+    user_cache.set(id, cached_user)
+    return cached_user
+
+
 async def get_verify_email(engine: AIOEngine, token: str) -> Optional[VerifyInDB]:
     """Get verify email by token"""
-    verify = await engine.find_one(VerifyInDB, VerifyInDB.token == token)
+    verify = await engine.find_one(
+        VerifyInDB,
+        VerifyInDB.token == token,
+        VerifyInDB.expired_at > datetime.utcnow(),
+    )
     if verify:
         return verify
     return None
@@ -33,7 +52,11 @@ async def get_verify_email(engine: AIOEngine, token: str) -> Optional[VerifyInDB
 
 async def get_user_reset(engine: AIOEngine, token: str) -> Optional[ResetInDB]:
     """Get user (reset password) by token"""
-    user_reset = await engine.find_one(ResetInDB, ResetInDB.token == token)
+    user_reset = await engine.find_one(
+        ResetInDB,
+        ResetInDB.token == token,
+        ResetInDB.expired_at > datetime.utcnow(),
+    )
     if user_reset:
         return user_reset
     return None
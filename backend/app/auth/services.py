@@ -4,11 +4,11 @@ import datetime
 from http import HTTPStatus
 from typing import Any, Optional
 
-from fastapi import Response, HTTPException, BackgroundTasks
+from fastapi import Response, HTTPException
 from odmantic import ObjectId, AIOEngine
 from pydantic import EmailStr
 
-from app.auth.utils import send_email, verify_password
+from app.auth.utils import verify_password_async
 from app.auth.models import (
     User,
     UserBase,
@@ -18,38 +18,42 @@ from app.auth.models import (
     UserInCreate,
     UserTokenInDB,
 )
+from app.core.mail import enqueue_email
 from app.core.config import settings
 from app.core.security import (
     create_access_token,
+    decode_access_token,
     create_refresh_token,
     decode_refresh_token,
 )
+from app.auth.cache import invalidate_user
+from app.auth.revocation import revocation_list
 from app.auth.selectors import get_user_by_email
 
 
-async def create_user(engine: AIOEngine, user: UserInCreate) -> Optional[UserBase]:
+async def create_user(engine: AIOEngine, user: UserInCreate) -> Optional[User]:
     """Create new user"""
-    user.change_password(user.password)
+    await user.change_password(user.password)
     username = user.email.split("@")[0]
     db_user = User(**user.dict(), username=username)
-    await engine.configure_database([User])
     await engine.save(db_user)
-    created_user = await get_user_by_email(engine, user.email)
-    return created_user
+    return db_user
 
 
-async def send_verify_email(
-    email: EmailStr, engine: AIOEngine, task: BackgroundTasks
-) -> Any:
-    """Send verification email"""
-    user = await get_user_by_email(engine, email)
+async def send_verify_email(user: User, engine: AIOEngine) -> Any:
+    """Queue verification email"""
     full_name = user.first_name + " " + user.last_name
     email: EmailStr = user.email
     token = "".join(
         random.choice(string.ascii_lowercase + string.digits) for _ in range(10)
     )
 
-    db_verify = VerifyInDB(email=email, token=token)
+    db_verify = VerifyInDB(
+        email=email,
+        token=token,
+        expired_at=datetime.datetime.utcnow()
+        + datetime.timedelta(seconds=settings.VERIFY_TOKEN_EXPIRE_SECONDS),
+    )
     await engine.save(db_verify)
 
     absurl = settings.SERVER_HOST + "api/auth/verify" + "?token=" + str(token)
@@ -68,24 +72,7 @@ async def send_verify_email(
         + "/login"
         + "</p>"
     )
-    email_from = settings.EMAILS_FROM_EMAIL
-    smtp_options = {"host": settings.SMTP_HOST, "port": settings.SMTP_PORT}
-    if settings.SMTP_TLS:
-        smtp_options["tls"] = True
-    if settings.SMTP_USER:
-        smtp_options["user"] = settings.SMTP_USER
-    if settings.SMTP_PASSWORD:
-        smtp_options["password"] = settings.SMTP_PASSWORD
-
-    data = {
-        "email_body": email_body,
-        "to_email": email,
-        "email_subject": "Verify your email",
-        "from": email_from,
-        "smtp": smtp_options,
-    }
-    print("sending mail...")
-    return task.add_task(send_email, data)
+    return await enqueue_email(engine, email, "Verify your email", email_body)
 
 
 async def authenticate(
@@ -95,25 +82,14 @@ async def authenticate(
     user = await get_user_by_email(engine, email)
     if not user:
         return None
-    if not verify_password(password, user.password):
+    if not await verify_password_async(password, user.password):
         return None
     return user
 
 
-async def generate_token(engine: AIOEngine, id: ObjectId, response: Response) -> str:
-    """Generate Refresh/Access token"""
-    access_token = create_access_token(id.__str__())
-    refresh_token = create_refresh_token(id.__str__())
-    user_token = UserTokenInDB(
-        user_id=id.__str__(),
-        token=refresh_token,
-        expired_at=datetime.datetime.utcnow()
-        + datetime.timedelta(seconds=settings.REFRESH_TOKEN_EXPIRE_SECONDS),
-    )
-    async with engine.session() as session:
-        await session.remove(UserTokenInDB, UserTokenInDB.user_id == id.__str__())
-        await session.save(user_token)
-
+def _set_token_cookies(
+    response: Response, access_token: str, refresh_token: str
+) -> None:
     response.set_cookie(
         "access_token",
         access_token,
@@ -132,6 +108,24 @@ async def generate_token(engine: AIOEngine, id: ObjectId, response: Response) ->
         max_age=settings.REFRESH_TOKEN_EXPIRE_SECONDS,
         expires=settings.REFRESH_TOKEN_EXPIRE_SECONDS,
     )
+
+
+def _refresh_expired_at() -> datetime.datetime:
+    return datetime.datetime.utcnow() + datetime.timedelta(
+        seconds=settings.REFRESH_TOKEN_EXPIRE_SECONDS
+    )
+
+
+async def generate_token(engine: AIOEngine, id: ObjectId, response: Response) -> str:
+    """Generate Refresh/Access token, replacing the user's refresh token"""
+    access_token = create_access_token(id.__str__())
+    refresh_token = create_refresh_token(id.__str__())
+    await engine.get_collection(UserTokenInDB).find_one_and_update(
+        {"user_id": id.__str__()},
+        {"$set": {"token": refresh_token, "expired_at": _refresh_expired_at()}},
+        upsert=True,
+    )
+    _set_token_cookies(response, access_token, refresh_token)
     token = "".join(
         random.choice(string.ascii_lowercase + string.digits) for _ in range(20)
     )
@@ -139,44 +133,68 @@ async def generate_token(engine: AIOEngine, id: ObjectId, response: Response) ->
 
 
 async def generate_access_token(
-    engine: AIOEngine, refresh_token: str, response: Response
+    engine: AIOEngine, refresh_token: Optional[str], response: Response
 ) -> str:
-    """Generate New Access token"""
+    """Generate New Access token, rotating the refresh token"""
+    if not refresh_token:
+        raise HTTPException(HTTPStatus.FORBIDDEN, "unauthenticated")
     user_id = decode_refresh_token(refresh_token)
-    user_token = await engine.find_one(UserTokenInDB, UserTokenInDB.user_id == user_id)
+    new_refresh_token = create_refresh_token(user_id)
+    # swap only if the presented token is still the current one, a replayed
+    # or logged out refresh token matches nothing
+    user_token = await engine.get_collection(UserTokenInDB).find_one_and_update(
+        {
+            "user_id": user_id,
+            "token": refresh_token,
+            "expired_at": {"$gt": datetime.datetime.utcnow()},
+        },
+        {"$set": {"token": new_refresh_token, "expired_at": _refresh_expired_at()}},
+    )
     if not user_token:
         raise HTTPException(HTTPStatus.FORBIDDEN, "unauthenticated")
 
-    access_token = create_access_token(user_id)
-    response.set_cookie(
-        "access_token",
-        access_token,
-        httponly=True,
-        samesite="none",
-        secure=True,
-        max_age=settings.ACCESS_TOKEN_EXPIRE_SECONDS,
-        expires=settings.ACCESS_TOKEN_EXPIRE_SECONDS,
-    )
+    _set_token_cookies(response, create_access_token(user_id), new_refresh_token)
     token = "".join(
         random.choice(string.ascii_lowercase + string.digits) for _ in range(20)
     )
     return token
 
 
-async def send_reset_password(
-    engine: AIOEngine, email: str, background_tasks: BackgroundTasks
-):
-    """Send reset password email"""
-
-    user = await get_user_by_email(engine, email)
+async def revoke_tokens(
+    engine: AIOEngine, access_token: Optional[str], refresh_token: Optional[str]
+) -> None:
+    """Revoke the access token and drop the refresh token of a session"""
+    if access_token:
+        try:
+            payload = decode_access_token(access_token)
+        except HTTPException:
+            payload = None
+        if payload and payload.get("jti"):
+            await revocation_list.revoke(
+                engine, payload["jti"], payload["user_id"], payload["exp"]
+            )
+    if refresh_token:
+        await engine.get_collection(UserTokenInDB).delete_one({"token": refresh_token})
+
+
+async def send_reset_password(engine: AIOEngine, user: User):
+    """Queue reset password email"""
     full_name = user.first_name + " " + user.last_name
     token = "".join(
         random.choice(string.ascii_lowercase + string.digits) for _ in range(10)
     )
-    reset = ResetInDB(email=user.email, token=token)
-    async with engine.session() as session:
-        await session.remove(ResetInDB, ResetInDB.email == user.email)
-        await session.save(reset)
+    # replaces a pending reset of the same email in one round trip
+    await engine.get_collection(ResetInDB).update_one(
+        {"email": user.email},
+        {
+            "$set": {
+                "token": token,
+                "expired_at": datetime.datetime.utcnow()
+                + datetime.timedelta(seconds=settings.RESET_TOKEN_EXPIRE_SECONDS),
+            }
+        },
+        upsert=True,
+    )
 
     url = settings.FRONTEND_URL + "/reset" + "?token=" + str(token)
     email_body = (
@@ -189,31 +207,17 @@ async def send_reset_password(
         + url
         + "</p>"
     )
-    email_from = settings.EMAILS_FROM_EMAIL
-    smtp_options = {"host": settings.SMTP_HOST, "port": settings.SMTP_PORT}
-    if settings.SMTP_TLS:
-        smtp_options["tls"] = True
-    if settings.SMTP_USER:
-        smtp_options["user"] = settings.SMTP_USER
-    if settings.SMTP_PASSWORD:
-        smtp_options["password"] = settings.SMTP_PASSWORD
-
-    data = {
-        "email_body": email_body,
-        "to_email": email,
-        "email_subject": "Reset your password",
-        "from": email_from,
-        "smtp": smtp_options,
-    }
-    return background_tasks.add_task(send_email, data)
+    return await enqueue_email(engine, user.email, "Reset your password", email_body)
 
 
 async def update_user_profile(
     engine: AIOEngine, data: UserInUpdate, user: UserBase
 ) -> UserBase:
-    user.first_name = data.first_name if data.first_name else user.first_name
-    user.last_name = data.last_name if data.last_name else user.last_name
-    user.role = data.role if data.role else user.role
-    await engine.save(user)
-    updated_user = await get_user_by_email(engine, user.email)
-    return updated_user
+    """Update user profile"""
+    db_user = await get_user_by_email(engine, user.email)
+    db_user.first_name = data.first_name if data.first_name else db_user.first_name
+    db_user.last_name = data.last_name if data.last_name else db_user.last_name
+    db_user.role = data.role if data.role else db_user.role
+    await engine.save(db_user)
+    invalidate_user(str(db_user.id))
+    return db_user
@@ -1,10 +1,18 @@
-import emails
+import asyncio
+from http import HTTPStatus
+from typing import Any, Callable, Optional
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+
+from fastapi import HTTPException
 from passlib.context import CryptContext
 
 from app.core.config import settings
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+_hash_executor: Optional[Executor] = None
+_hash_pending = 0
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
@@ -14,6 +22,54 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+def get_hash_executor() -> Executor:
+    global _hash_executor
+    if _hash_executor is None:
+        if settings.PASSWORD_HASH_EXECUTOR == "process":
+            _hash_executor = ProcessPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS
+            )
+        else:
+            _hash_executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS,
+                thread_name_prefix="password-hash",
+            )
+    return _hash_executor
+
+
+def shutdown_hash_executor() -> None:
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=False, cancel_futures=True)
+        _hash_executor = None
+
+
+async def _run_hash(func: Callable[..., Any], *args: Any) -> Any:
+    """Run a bcrypt call on the hash pool, fail fast when the queue is full"""
+    global _hash_pending
+    capacity = settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_SIZE
+    if _hash_pending >= capacity:
+        raise HTTPException(
+            status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+            detail="Server is busy, try again later",
+            headers={"Retry-After": "1"},
+        )
+    _hash_pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_hash_executor(), func, *args)
+    finally:
+        _hash_pending -= 1
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_hash(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_hash(get_password_hash, password)
+
+
 def password_match(v: str, values) -> str:
     if " " in v:
         raise ValueError("password space")
@@ -25,15 +81,3 @@ def password_match(v: str, values) -> str:
         if letter not in settings.PASSWORD_CHARS:
             raise ValueError("password special")
     return v
-
-
-def send_email(data: dict):
-    email = emails.Message(
-        subject=data["email_subject"],
-        html=data["email_body"],
-        mail_to=[data["to_email"]],
-        mail_from=data["from"],
-    )
-    email.send(
-        smtp=data["smtp"],
-    )
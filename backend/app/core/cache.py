@@ -0,0 +1,84 @@
+import time
+from typing import Any, Dict, Callable, Hashable, Optional
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Bounded in-process LRU cache with a per-entry time to live.
+
+    Bounded by entry count and, when ``sizeof`` is given, by the summed size
+    of the values. Caches are per worker process, writes only invalidate the
+    local copy, so the ttl bounds how stale other workers can be.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: Optional[float] = None,
+        maxbytes: Optional[int] = None,
+        sizeof: Optional[Callable[[Any], int]] = None,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.currbytes = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at, _ = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.pop(key)
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        size = self.sizeof(value) if self.sizeof else 0
+        if self.maxbytes is not None and size > self.maxbytes:
+            return
+        self.pop(key)
+        self._data[key] = (value, expires_at, size)
+        self.currbytes += size
+        while len(self._data) > self.maxsize or (
+            self.maxbytes is not None and self.currbytes > self.maxbytes
+        ):
+            _, (_, _, evicted_size) = self._data.popitem(last=False)
+            self.currbytes -= evicted_size
+            self.evictions += 1
+
+    def pop(self, key: Hashable) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.currbytes -= entry[2]
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.currbytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "bytes": self.currbytes,
+            "maxbytes": self.maxbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
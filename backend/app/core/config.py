@@ -18,8 +18,104 @@ class Settings(BaseSettings):
     # JWT token
     ACCESS_TOKEN_EXPIRE_SECONDS: int = 60 * 60 * 24  # one day
     REFRESH_TOKEN_EXPIRE_SECONDS: int = 60 * 60 * 24 * 7  # one week
+    RESET_TOKEN_EXPIRE_SECONDS: int = 60 * 60  # one hour
+    VERIFY_TOKEN_EXPIRE_SECONDS: int = 60 * 60 * 24 * 2  # two days
     SECRET_KEY: str = secrets.token_urlsafe(32)
+    SECRET_KEY_ID: str = "default"  # kid header of newly signed tokens
+    # retired keys by kid, still accepted until their tokens expire
+    PREVIOUS_SECRET_KEYS: Dict[str, str] = {}
     JWT_ALGORITHM: str = "HS256"
+    TOKEN_CACHE_SIZE: int = 10_000  # verified access tokens, per worker
+    REVOCATION_SYNC_SECONDS: float = 5.0  # revoked tokens reach other workers
+
+    # Auth endpoint rate limits, per client IP and per email, per worker
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_LOGIN_PER_MINUTE: float = 10
+    RATE_LIMIT_LOGIN_BURST: int = 5
+    RATE_LIMIT_REGISTER_PER_MINUTE: float = 5
+    RATE_LIMIT_REGISTER_BURST: int = 3
+    RATE_LIMIT_RECOVER_PER_MINUTE: float = 2
+    RATE_LIMIT_RECOVER_BURST: int = 3
+    RATE_LIMIT_MAX_KEYS: int = 100_000  # buckets per route, least recent evicted
+    RATE_LIMIT_SHARDS: int = 16
+
+    # Authenticated user cache, per worker
+    USER_CACHE_SIZE: int = 10_000
+    USER_CACHE_TTL_SECONDS: int = 60
+
+    # Listing response cache, per worker and per cached endpoint
+    RESPONSE_CACHE_SIZE: int = 1024
+    RESPONSE_CACHE_MAX_BYTES: int = 32 * 1024 * 1024  # 32 MiB
+    RESPONSE_CACHE_TTL_SECONDS: int = 60
+    RESPONSE_CACHE_MAX_AGE: int = 0  # clients revalidate with If-None-Match
+    FEED_COUNT_CACHE_SIZE: int = 1024
+    FEED_COUNT_CACHE_TTL_SECONDS: int = 30
+    FACET_CITY_LIMIT: int = 20
+    FACET_PRICE_BOUNDARIES: List[float] = [
+        0,
+        50_000,
+        100_000,
+        250_000,
+        500_000,
+        1_000_000,
+    ]
+
+    # Upcoming reservations embedded in the property detail, by date_start
+    PROPERTY_RESERVATIONS_LIMIT: int = 50
+
+    # Per-property booking lock, serializes overlap check and insert
+    BOOKING_LOCK_TIMEOUT_SECONDS: int = 10
+    BOOKING_LOCK_ATTEMPTS: int = 20
+    BOOKING_LOCK_RETRY_DELAY: float = 0.05
+    AVAILABILITY_MAX_DAYS: int = 366  # longest range served by /availability
+
+    # Full-text search, deep pages of a relevance sort are not seekable
+    SEARCH_MAX_OFFSET: int = 1000
+    SEARCH_MAX_LIMIT: int = 100
+
+    # Listings export and import
+    EXPORT_BATCH_SIZE: int = 1000
+    IMPORT_BATCH_SIZE: int = 500  # listings per insert_many
+    IMPORT_MAX_ITEMS: int = 50_000  # listings per request
+    SLUG_MAX_ATTEMPTS: int = 5  # counter suffixes tried before a random one
+
+    # Server, see main.py
+    SERVER_BIND_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: Optional[int] = None  # defaults to the CPU count
+    SERVER_KEEP_ALIVE_SECONDS: int = 5
+    SERVER_BACKLOG: int = 2048
+    SERVER_GRACEFUL_SHUTDOWN_SECONDS: int = 30
+    # proxies trusted for X-Forwarded-For, the client IP of rate limits
+    FORWARDED_ALLOW_IPS: str = "127.0.0.1"
+
+    # Prometheus metrics on /metrics
+    METRICS_ENABLED: bool = True
+    METRICS_LATENCY_BUCKETS: List[float] = [
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1,
+        2.5,
+        5,
+        10,
+    ]
+    # most Mongo commands a request may send, by "METHOD route" with the route
+    # relative to API_STR, going over is logged and counted in
+    # mongo_command_budget_exceeded, and fails tests/test_command_budgets.py
+    MONGO_COMMAND_BUDGETS: Dict[str, int] = {
+        "POST /auth/register": 4,
+        "POST /auth/login": 2,
+        "GET /auth/profile": 1,
+        "GET /feed/": 2,
+        "POST /feed/": 3,  # slug conflicts add a counter $inc
+        "GET /feed/{slug}": 1,
+    }
+    MONGO_COMMANDS_HEADER: bool = False  # add X-Mongo-Commands to responses
 
     # BACKEND CORS ORIGINS
     BACKEND_CORS_ORIGINS: List[AnyHttpUrl] = [
@@ -52,6 +148,13 @@ class Settings(BaseSettings):
 
     database_name: str = MONGO_DB
 
+    # Mongodb connection pool (one pool per worker process)
+    MONGO_MAX_POOL_SIZE: int = 100
+    MONGO_MIN_POOL_SIZE: int = 0
+    MONGO_MAX_IDLE_TIME_MS: Optional[int] = 60 * 1000  # one minute
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: Optional[int] = 5 * 1000  # five seconds
+    MONGO_APPLY_INDEXES: bool = True  # see app/core/migrations.py
+
     # SMTP
     SMTP_TLS: bool = False
     SMTP_PORT: Optional[int] = None
@@ -60,6 +163,15 @@ class Settings(BaseSettings):
     SMTP_PASSWORD: Optional[str] = None
     EMAILS_FROM_EMAIL: Optional[EmailStr] = None
     EMAILS_FROM_NAME: Optional[str] = None
+    SMTP_TIMEOUT: int = 10
+
+    # Email outbox, drained by a sender in every worker
+    EMAIL_OUTBOX_BATCH_SIZE: int = 50
+    EMAIL_OUTBOX_POLL_SECONDS: float = 2.0
+    EMAIL_OUTBOX_MAX_ATTEMPTS: int = 5
+    EMAIL_OUTBOX_RETRY_SECONDS: int = 30  # doubled after each failed attempt
+    EMAIL_OUTBOX_LOCK_SECONDS: int = 120  # reclaim emails of a dead sender
+    EMAIL_OUTBOX_KEEP_SENT_SECONDS: int = 60 * 60 * 24 * 7  # one week
 
     @validator("EMAILS_FROM_NAME")
     def get_project_name(cls, v: Optional[str], values: Dict[str, Any]) -> str:
@@ -71,6 +183,11 @@ class Settings(BaseSettings):
     PASSWORD_MAX_LENGTH: int = 32
     PASSWORD_CHARS = "".join([ascii_letters, digits, punctuation])
 
+    # bcrypt runs off the event loop, "thread" or "process" pool
+    PASSWORD_HASH_EXECUTOR: str = "thread"
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_QUEUE_SIZE: int = 64  # waiting hashes before answering 503
+
     class Config:
         env_file = ".env"
         case_sensitive = True
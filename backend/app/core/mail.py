@@ -0,0 +1,209 @@
+import enum
+import uuid
+import asyncio
+import logging
+import datetime
+from typing import List, Optional
+from email.utils import formataddr
+from email.message import EmailMessage
+
+import aiosmtplib
+from odmantic import Field, Model, AIOEngine
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxStatus(str, enum.Enum):
+    status_pending = "pending"
+    status_sending = "sending"
+    status_sent = "sent"
+    status_dead = "dead"
+
+
+class OutboxEmail(Model):
+    to_email: str
+    subject: str
+    html: str
+    status: OutboxStatus = OutboxStatus.status_pending
+    attempts: int = 0
+    next_attempt_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+    locked_until: Optional[datetime.datetime] = None
+    sent_at: Optional[datetime.datetime] = None
+    last_error: str = ""
+    claim_id: Optional[str] = None
+
+    class Config:
+        collection = "email_outbox"
+
+
+async def enqueue_email(
+    engine: AIOEngine, to_email: str, subject: str, html: str
+) -> OutboxEmail:
+    """Persist an email, the outbox sender delivers it"""
+    email = OutboxEmail(to_email=to_email, subject=subject, html=html)
+    await engine.save(email)
+    return email
+
+
+def _build_message(email: OutboxEmail) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = formataddr(
+        (settings.EMAILS_FROM_NAME or "", settings.EMAILS_FROM_EMAIL or "")
+    )
+    message["To"] = email.to_email
+    message["Subject"] = email.subject
+    message.set_content(email.html, subtype="html")
+    return message
+
+
+class OutboxSender:
+    """Drain the email outbox over one reused SMTP connection.
+
+    Emails are claimed atomically, so every worker can run a sender. Failed
+    sends are retried with exponential backoff, then marked dead.
+    """
+
+    def __init__(self, engine: AIOEngine) -> None:
+        self.engine = engine
+        self.collection = engine.get_collection(OutboxEmail)
+        self._smtp: Optional[aiosmtplib.SMTP] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = asyncio.Event()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task:
+            await self._task
+        await self._disconnect()
+
+    async def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                sent = await self.drain_batch()
+            except Exception:
+                logger.exception("Email outbox batch failed")
+                sent = 0
+            if sent:
+                continue
+            # nothing to send, release the connection until there is
+            await self._disconnect()
+            try:
+                await asyncio.wait_for(
+                    self._stopped.wait(), settings.EMAIL_OUTBOX_POLL_SECONDS
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim_batch(self) -> List[OutboxEmail]:
+        """Claim a batch in three round trips whatever its size.
+
+        The candidates are stamped with a fresh claim id, the filter is
+        repeated in the update so an email claimed meanwhile by another
+        worker is skipped, then the batch is read back by its claim id.
+        """
+        now = datetime.datetime.utcnow()
+        locked_until = now + datetime.timedelta(
+            seconds=settings.EMAIL_OUTBOX_LOCK_SECONDS
+        )
+        claimable = {
+            "$or": [
+                {
+                    "status": OutboxStatus.status_pending,
+                    "next_attempt_at": {"$lte": now},
+                },
+                # claimed by a worker that died while sending
+                {"status": OutboxStatus.status_sending, "locked_until": {"$lt": now}},
+            ]
+        }
+        candidates = self.collection.find(
+            claimable,
+            {"_id": 1},
+            sort=[("next_attempt_at", 1)],
+            limit=settings.EMAIL_OUTBOX_BATCH_SIZE,
+        )
+        ids = [document["_id"] async for document in candidates]
+        if not ids:
+            return []
+        claim_id = uuid.uuid4().hex
+        await self.collection.update_many(
+            {"_id": {"$in": ids}, **claimable},
+            {
+                "$set": {
+                    "status": OutboxStatus.status_sending,
+                    "locked_until": locked_until,
+                    "claim_id": claim_id,
+                }
+            },
+        )
+        claimed = self.collection.find(
+            {"_id": {"$in": ids}, "claim_id": claim_id}, sort=[("next_attempt_at", 1)]
+        )
+        return [OutboxEmail.parse_doc(document) async for document in claimed]
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        if self._smtp is None or not self._smtp.is_connected:
+            self._smtp = aiosmtplib.SMTP(
+                hostname=settings.SMTP_HOST,
+                port=settings.SMTP_PORT,
+                start_tls=settings.SMTP_TLS,
+                timeout=settings.SMTP_TIMEOUT,
+            )
+            await self._smtp.connect()
+            if settings.SMTP_USER:
+                await self._smtp.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
+        return self._smtp
+
+    async def _disconnect(self) -> None:
+        if self._smtp is not None and self._smtp.is_connected:
+            try:
+                await self._smtp.quit()
+            except aiosmtplib.SMTPException:
+                self._smtp.close()
+        self._smtp = None
+
+    async def drain_batch(self) -> int:
+        """Send one claimed batch, return how many emails were claimed"""
+        emails = await self._claim_batch()
+        sent_ids = []
+        try:
+            for email in emails:
+                try:
+                    smtp = await self._connect()
+                    await smtp.send_message(_build_message(email))
+                    sent_ids.append(email.id)
+                except (aiosmtplib.SMTPException, OSError) as exc:
+                    await self._disconnect()
+                    await self._retry_later(email, exc)
+        finally:
+            # record what went out even if the batch is interrupted, so a
+            # sender taking over the expired claims does not send it twice
+            if sent_ids:
+                await self.collection.update_many(
+                    {"_id": {"$in": sent_ids}},
+                    {
+                        "$set": {
+                            "status": OutboxStatus.status_sent,
+                            "sent_at": datetime.datetime.utcnow(),
+                            "locked_until": None,
+                        }
+                    },
+                )
+        return len(emails)
+
+    async def _retry_later(self, email: OutboxEmail, exc: Exception) -> None:
+        attempts = email.attempts + 1
+        update = {"attempts": attempts, "locked_until": None, "last_error": str(exc)}
+        if attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+            logger.error("Email %s to %s is dead: %s", email.id, email.to_email, exc)
+            update["status"] = OutboxStatus.status_dead
+        else:
+            update["status"] = OutboxStatus.status_pending
+            update["next_attempt_at"] = datetime.datetime.utcnow() + datetime.timedelta(
+                seconds=settings.EMAIL_OUTBOX_RETRY_SECONDS * 2 ** (attempts - 1)
+            )
+        await self.collection.update_one({"_id": email.id}, {"$set": update})
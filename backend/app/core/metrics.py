@@ -0,0 +1,192 @@
+"""Prometheus metrics, served on ``/metrics``.
+
+Each worker keeps its own registry. When the server runs several workers,
+set ``PROMETHEUS_MULTIPROC_DIR`` to an empty directory so ``/metrics``
+aggregates all of them.
+"""
+
+import os
+import time
+import logging
+from typing import Dict, Optional
+from contextvars import ContextVar
+
+from pymongo import monitoring
+from fastapi import Request, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Gauge,
+    Counter,
+    Histogram,
+    CollectorRegistry,
+    generate_latest,
+    multiprocess,
+)
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route", "status"],
+    buckets=settings.METRICS_LATENCY_BUCKETS,
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "HTTP requests being served",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongo_command_duration_seconds",
+    "Mongo command latency by command",
+    ["command"],
+    buckets=settings.METRICS_LATENCY_BUCKETS,
+)
+MONGO_COMMANDS = Counter(
+    "mongo_commands",
+    "Mongo commands sent while serving a route",
+    ["route", "command"],
+)
+MONGO_COMMANDS_PER_REQUEST = Histogram(
+    "mongo_commands_per_request",
+    "Mongo commands sent per HTTP request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50),
+)
+MONGO_COMMAND_BUDGET_EXCEEDED = Counter(
+    "mongo_command_budget_exceeded",
+    "Requests that sent more Mongo commands than their route budget",
+    ["route"],
+)
+
+
+class RequestMetrics:
+    """Mongo commands of the request being served"""
+
+    def __init__(self) -> None:
+        self.commands: Dict[str, int] = {}
+        self.command_seconds = 0.0
+
+    @property
+    def command_count(self) -> int:
+        return sum(self.commands.values())
+
+
+# set by the middleware, the command listener runs in the request's context
+current_request_metrics: ContextVar[Optional[RequestMetrics]] = ContextVar(
+    "current_request_metrics", default=None
+)
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """Time every Mongo command and count it against the current request"""
+
+    def _record(self, event) -> None:
+        seconds = event.duration_micros / 1_000_000
+        MONGO_COMMAND_LATENCY.labels(event.command_name).observe(seconds)
+        request_metrics = current_request_metrics.get()
+        if request_metrics is not None:
+            commands = request_metrics.commands
+            commands[event.command_name] = commands.get(event.command_name, 0) + 1
+            request_metrics.command_seconds += seconds
+
+    def started(self, event) -> None:
+        pass
+
+    def succeeded(self, event) -> None:
+        self._record(event)
+
+    def failed(self, event) -> None:
+        self._record(event)
+
+
+command_metrics = CommandMetricsListener()
+
+
+def get_route_name(scope: Scope) -> str:
+    """Route path template, unmatched paths share one label"""
+    route = scope.get("route")
+    return getattr(route, "path_format", None) or "unmatched"
+
+
+def get_command_budget(method: str, route: str) -> Optional[int]:
+    """Mongo command budget of a route, see MONGO_COMMAND_BUDGETS"""
+    if route.startswith(settings.API_STR):
+        route = route[len(settings.API_STR) :]
+    return settings.MONGO_COMMAND_BUDGETS.get(f"{method} {route}")
+
+
+class MetricsMiddleware:
+    """Time each HTTP request and attribute its Mongo commands to the route"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_metrics = RequestMetrics()
+        token = current_request_metrics.set(request_metrics)
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if settings.MONGO_COMMANDS_HEADER:
+                    # commands of a streamed body are not counted yet
+                    count = str(request_metrics.command_count).encode()
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"x-mongo-commands", count),
+                    ]
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(scope["method"])
+        in_progress.inc()
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            in_progress.dec()
+            current_request_metrics.reset(token)
+            route = get_route_name(scope)
+            REQUEST_LATENCY.labels(scope["method"], route, str(status)).observe(elapsed)
+            for command, count in request_metrics.commands.items():
+                MONGO_COMMANDS.labels(route, command).inc(count)
+            command_count = request_metrics.command_count
+            MONGO_COMMANDS_PER_REQUEST.labels(route).observe(command_count)
+            budget = get_command_budget(scope["method"], route)
+            if budget is not None and command_count > budget:
+                MONGO_COMMAND_BUDGET_EXCEEDED.labels(route).inc()
+                logger.warning(
+                    "%s %s sent %d Mongo commands, budget is %d: %s",
+                    scope["method"],
+                    route,
+                    command_count,
+                    budget,
+                    request_metrics.commands,
+                )
+
+
+def mark_worker_dead() -> None:
+    """Drop the live gauges of this worker from the multiprocess metrics"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+async def metrics(request: Request) -> Response:
+    """Metrics in the Prometheus text format"""
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,293 @@
+"""Declared Mongo indexes, applied at startup with the data fixes they need.
+
+Run ``python -m app.core.migrations`` to apply them by hand, ``--report`` to
+list missing, undeclared and unused indexes without changing anything, and
+``--availability`` to rebuild the occupancy bitmaps from the reservations.
+"""
+
+import json
+import asyncio
+import argparse
+from typing import Any, Dict, List
+
+from odmantic import AIOEngine
+from pymongo import TEXT, ASCENDING, DESCENDING, IndexModel
+
+from app.auth.models import (
+    User,
+    ResetInDB,
+    VerifyInDB,
+    UserTokenInDB,
+    RevokedTokenInDB,
+)
+from app.core.mail import OutboxEmail
+from app.core.config import settings
+from app.core.services import create_engine, create_mongo_client
+from app.listings.models import Property, Reservation
+from app.listings.selectors import AVAILABILITY_COLLECTION
+from app.listings.services import (
+    BOOKING_LOCK_COLLECTION,
+    next_slug_suffix,
+    rebuild_property_availability,
+)
+
+# compared against ``index_information()`` to detect changed declarations
+INDEX_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    User.__collection__: [
+        IndexModel([("email", ASCENDING)], unique=True),
+        IndexModel([("username", ASCENDING)], unique=True),
+    ],
+    Property.__collection__: [
+        IndexModel([("slug", ASCENDING)], unique=True),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel(
+            [
+                ("owner.username", ASCENDING),
+                ("created_at", DESCENDING),
+                ("_id", DESCENDING),
+            ]
+        ),
+        IndexModel(
+            [
+                ("property_type", ASCENDING),
+                ("created_at", DESCENDING),
+                ("_id", DESCENDING),
+            ]
+        ),
+        IndexModel(
+            [
+                ("address.city", ASCENDING),
+                ("created_at", DESCENDING),
+                ("_id", DESCENDING),
+            ]
+        ),
+        IndexModel([("property_type", ASCENDING), ("price", ASCENDING)]),
+        IndexModel([("address.city", ASCENDING), ("price", ASCENDING)]),
+        IndexModel(
+            [("title", TEXT), ("description", TEXT)],
+            weights={"title": 10, "description": 1},
+        ),
+    ],
+    Reservation.__collection__: [
+        IndexModel(
+            [
+                ("property_id", ASCENDING),
+                ("date_start", ASCENDING),
+                ("date_end", ASCENDING),
+            ]
+        ),
+    ],
+    OutboxEmail.__collection__: [
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)]),
+        IndexModel(
+            [("sent_at", ASCENDING)],
+            expireAfterSeconds=settings.EMAIL_OUTBOX_KEEP_SENT_SECONDS,
+            partialFilterExpression={"status": "sent"},
+        ),
+    ],
+    # locks left by a crashed worker, expired_at is also checked on acquire
+    BOOKING_LOCK_COLLECTION: [
+        IndexModel([("expired_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    # expired_at is the expiry date itself, so the TTL monitor uses no offset
+    UserTokenInDB.__collection__: [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+        IndexModel([("token", ASCENDING)], unique=True),
+        IndexModel([("expired_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    # revoked_at drives the incremental sync of the in-memory revocation list
+    RevokedTokenInDB.__collection__: [
+        IndexModel([("jti", ASCENDING)], unique=True),
+        IndexModel([("revoked_at", ASCENDING)]),
+        IndexModel([("expired_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    ResetInDB.__collection__: [
+        IndexModel([("email", ASCENDING)], unique=True),
+        IndexModel([("token", ASCENDING)], unique=True),
+        IndexModel([("expired_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    VerifyInDB.__collection__: [
+        IndexModel([("email", ASCENDING)], unique=True),
+        IndexModel([("token", ASCENDING)], unique=True),
+        IndexModel([("expired_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+
+def _index_matches(declared: Dict[str, Any], existing: Dict[str, Any]) -> bool:
+    if TEXT in declared["key"].values():
+        # text indexes are stored under _fts/_ftsx keys, fields are in weights
+        weights = {field: 1 for field, kind in declared["key"].items() if kind == TEXT}
+        weights.update(declared.get("weights", {}))
+        if dict(existing.get("weights", {})) != weights:
+            return False
+    elif list(declared["key"].items()) != [tuple(key) for key in existing["key"]]:
+        return False
+    return all(declared.get(option) == existing.get(option) for option in INDEX_OPTIONS)
+
+
+async def dedupe_slugs(engine: AIOEngine) -> Dict[str, List[str]]:
+    """Rename duplicate property slugs so the unique slug index can be built.
+
+    The oldest property keeps its slug, the others get a suffix from the
+    shared slug counter, skipping suffixes already taken.
+    """
+    collection = engine.get_collection(Property)
+    renamed: Dict[str, List[str]] = {}
+    duplicates = collection.aggregate(
+        [
+            {"$sort": {"created_at": ASCENDING, "_id": ASCENDING}},
+            {"$group": {"_id": "$slug", "ids": {"$push": "$_id"}}},
+            {"$match": {"ids.1": {"$exists": True}}},
+        ],
+        allowDiskUse=True,
+    )
+    async for duplicate in duplicates:
+        slug = duplicate["_id"]
+        for property_id in duplicate["ids"][1:]:
+            new_slug = f"{slug}-{await next_slug_suffix(engine, slug)}"
+            while await collection.count_documents({"slug": new_slug}, limit=1):
+                new_slug = f"{slug}-{await next_slug_suffix(engine, slug)}"
+            await collection.update_one(
+                {"_id": property_id}, {"$set": {"slug": new_slug}}
+            )
+            renamed.setdefault(slug, []).append(new_slug)
+    return renamed
+
+
+async def backfill_created_at(engine: AIOEngine) -> int:
+    """Date the properties stored before created_at was persisted by their _id.
+
+    The feed sorts and seeks on created_at, documents without it would sort
+    last and never match the cursor. Matching on null uses the feed index.
+    """
+    created_at = {"$toDate": "$_id"}
+    result = await engine.get_collection(Property).update_many(
+        {"created_at": None},
+        [
+            {
+                "$set": {
+                    "created_at": created_at,
+                    "updated_at": {"$ifNull": ["$updated_at", created_at]},
+                }
+            }
+        ],
+    )
+    return result.modified_count
+
+
+async def apply_indexes(engine: AIOEngine, prune: bool = False) -> Dict[str, Any]:
+    """Create missing indexes, rebuild changed ones, optionally drop undeclared"""
+    applied = {}
+    for collection_name, indexes in INDEXES.items():
+        collection = engine.database[collection_name]
+        existing = await collection.index_information()
+        created, dropped, renamed, backfilled = [], [], {}, 0
+        for index in indexes:
+            name = index.document["name"]
+            if name in existing and _index_matches(index.document, existing[name]):
+                continue
+            if name in existing:
+                await collection.drop_index(name)
+                dropped.append(name)
+            created.append(index)
+        if collection_name == Property.__collection__ and any(
+            index.document.get("unique") and "slug" in index.document["key"]
+            for index in created
+        ):
+            renamed = await dedupe_slugs(engine)
+        if collection_name == Property.__collection__:
+            backfilled = await backfill_created_at(engine)
+        if created:
+            await collection.create_indexes(created)
+        if prune:
+            declared = {index.document["name"] for index in indexes}
+            for name in existing:
+                if name != "_id_" and name not in declared:
+                    await collection.drop_index(name)
+                    dropped.append(name)
+        applied[collection_name] = {
+            "created": [index.document["name"] for index in created],
+            "dropped": dropped,
+        }
+        if renamed:
+            applied[collection_name]["renamed_slugs"] = renamed
+        if backfilled:
+            applied[collection_name]["backfilled_created_at"] = backfilled
+    return applied
+
+
+async def index_report(engine: AIOEngine) -> Dict[str, Any]:
+    """Missing, undeclared and unused indexes (usage counts reset on restart)"""
+    report = {}
+    for collection_name, indexes in INDEXES.items():
+        collection = engine.database[collection_name]
+        existing = await collection.index_information()
+        declared = {index.document["name"]: index.document for index in indexes}
+        usage = {
+            stats["name"]: stats["accesses"]["ops"]
+            async for stats in collection.aggregate([{"$indexStats": {}}])
+        }
+        report[collection_name] = {
+            "missing": [
+                name
+                for name, document in declared.items()
+                if name not in existing or not _index_matches(document, existing[name])
+            ],
+            "undeclared": [
+                name for name in existing if name != "_id_" and name not in declared
+            ],
+            "unused": [
+                name for name, ops in usage.items() if name != "_id_" and not ops
+            ],
+        }
+    return report
+
+
+async def backfill_availability(engine: AIOEngine) -> Dict[str, int]:
+    """Rebuild the occupancy bitmaps of every property with reservations,
+    and drop the stale bitmaps of properties without any"""
+    rebuilt = {}
+    property_ids = set(await engine.get_collection(Reservation).distinct("property_id"))
+    property_ids.update(
+        await engine.database[AVAILABILITY_COLLECTION].distinct("property_id")
+    )
+    for property_id in sorted(property_ids):
+        rebuilt[property_id] = await rebuild_property_availability(engine, property_id)
+    return rebuilt
+
+
+async def main(report: bool, prune: bool, availability: bool) -> None:
+    client = create_mongo_client()
+    try:
+        engine = create_engine(client)
+        if availability:
+            result = await backfill_availability(engine)
+        elif report:
+            result = await index_report(engine)
+        else:
+            result = await apply_indexes(engine, prune=prune)
+        print(json.dumps(result, indent=2))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply the declared Mongo indexes")
+    parser.add_argument(
+        "--report", action="store_true", help="only report, change nothing"
+    )
+    parser.add_argument(
+        "--prune", action="store_true", help="drop indexes that are not declared"
+    )
+    parser.add_argument(
+        "--availability",
+        action="store_true",
+        help="rebuild the occupancy bitmaps from the reservations",
+    )
+    args = parser.parse_args()
+    asyncio.run(
+        main(report=args.report, prune=args.prune, availability=args.availability)
+    )
@@ -1,12 +1,13 @@
 from datetime import datetime
 
+from pydantic import Field
 from odmantic.bson import BSON_TYPES_ENCODERS, BaseBSONModel, ObjectId
 
 
 class BaseModelClass(BaseBSONModel):
     id: ObjectId = ObjectId()
-    created_at: datetime = datetime.now()
-    updated_at: datetime = datetime.now()
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
     class Config:
         allow_population_by_field_name = True
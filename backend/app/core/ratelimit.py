@@ -0,0 +1,115 @@
+import math
+import time
+from http import HTTPStatus
+from typing import Any, Dict, List, Tuple, Callable, Optional
+from collections import OrderedDict
+
+from fastapi import Request, HTTPException
+
+from app.core.config import settings
+
+
+class RateLimiter:
+    """Token buckets keyed by client, in bounded LRU shards.
+
+    A bucket holds up to ``burst`` tokens and refills ``rate`` tokens per
+    second. Each shard keeps its least recently used buckets only, so memory
+    stays bounded however many IPs or emails show up. Limits are per worker.
+    """
+
+    def __init__(self, rate: float, burst: int, maxsize: int, shards: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.shard_size = max(1, maxsize // shards)
+        # key -> (tokens, monotonic time of the last update)
+        self._shards: List["OrderedDict[str, Tuple[float, float]]"] = [
+            OrderedDict() for _ in range(shards)
+        ]
+        self.rejected = 0
+        self.evictions = 0
+
+    def hit(self, key: str) -> float:
+        """Take a token, return 0 or the seconds until one is available"""
+        shard = self._shards[hash(key) % len(self._shards)]
+        now = time.monotonic()
+        tokens, updated_at = shard.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / self.rate
+            self.rejected += 1
+        shard[key] = (tokens, now)
+        if len(shard) > self.shard_size:
+            shard.popitem(last=False)
+            self.evictions += 1
+        return retry_after
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "keys": sum(len(shard) for shard in self._shards),
+            "maxsize": self.shard_size * len(self._shards),
+            "rejected": self.rejected,
+            "evictions": self.evictions,
+        }
+
+
+def _create_limiter(per_minute: float, burst: int) -> RateLimiter:
+    return RateLimiter(
+        rate=per_minute / 60,
+        burst=burst,
+        maxsize=settings.RATE_LIMIT_MAX_KEYS,
+        shards=settings.RATE_LIMIT_SHARDS,
+    )
+
+
+rate_limiters: Dict[str, RateLimiter] = {
+    "login": _create_limiter(
+        settings.RATE_LIMIT_LOGIN_PER_MINUTE, settings.RATE_LIMIT_LOGIN_BURST
+    ),
+    "register": _create_limiter(
+        settings.RATE_LIMIT_REGISTER_PER_MINUTE, settings.RATE_LIMIT_REGISTER_BURST
+    ),
+    "recover_password": _create_limiter(
+        settings.RATE_LIMIT_RECOVER_PER_MINUTE, settings.RATE_LIMIT_RECOVER_BURST
+    ),
+}
+
+
+async def _get_request_email(request: Request) -> Optional[str]:
+    email = request.query_params.get("email")
+    content_type = request.headers.get("content-type", "")
+    if email is None and content_type.startswith("application/json"):
+        # already read and validated by FastAPI, the body is cached
+        body = await request.json()
+        if isinstance(body, dict):
+            # login posts {"email"}, register embeds it as {"user": {"email"}}
+            user = body.get("user")
+            email = body.get("email") or (
+                user.get("email") if isinstance(user, dict) else None
+            )
+    return email.lower() if isinstance(email, str) else None
+
+
+def rate_limit(name: str) -> Callable:
+    """Dependency rejecting a client over the limit before the endpoint runs"""
+    limiter = rate_limiters[name]
+
+    async def _check_rate_limit(request: Request) -> None:
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+        keys = [f"ip:{request.client.host if request.client else ''}"]
+        email = await _get_request_email(request)
+        if email:
+            keys.append(f"email:{email}")
+        for key in keys:
+            retry_after = limiter.hit(key)
+            if retry_after:
+                raise HTTPException(
+                    status_code=HTTPStatus.TOO_MANY_REQUESTS,
+                    detail="Too many requests",
+                    headers={"Retry-After": str(math.ceil(retry_after))},
+                )
+
+    return _check_rate_limit
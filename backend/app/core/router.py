@@ -0,0 +1,39 @@
+from http import HTTPStatus
+from typing import Any
+
+from fastapi import APIRouter
+
+from app.auth.cache import user_cache
+from app.auth.revocation import revocation_list
+from app.core.security import token_cache
+from app.core.ratelimit import rate_limiters
+from app.core.services import pool_stats
+from app.listings.cache import count_cache, feed_cache, facet_cache, property_cache
+
+router = APIRouter(prefix="/health")
+
+
+@router.get("/db", status_code=HTTPStatus.OK)
+async def db_pool_stats() -> Any:
+    """Mongo connection pool stats of this worker"""
+    return {"pool": pool_stats.stats()}
+
+
+@router.get("/caches", status_code=HTTPStatus.OK)
+async def cache_stats() -> Any:
+    """In-process cache stats of this worker"""
+    return {
+        "user": user_cache.stats(),
+        "token": token_cache.stats(),
+        "feed": feed_cache.stats(),
+        "property": property_cache.stats(),
+        "count": count_cache.stats(),
+        "facet": facet_cache.stats(),
+        "revoked_tokens": len(revocation_list),
+    }
+
+
+@router.get("/rate_limits", status_code=HTTPStatus.OK)
+async def rate_limit_stats() -> Any:
+    """Auth rate limiter stats of this worker"""
+    return {name: limiter.stats() for name, limiter in rate_limiters.items()}
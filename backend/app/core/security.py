@@ -1,6 +1,9 @@
+import time
+import uuid
+import hashlib
 import datetime
 from http import HTTPStatus
-from typing import Optional
+from typing import Any, Dict, Optional
 
 import jwt
 from jwt import PyJWTError
@@ -8,9 +11,11 @@ from fastapi import Depends, Request, HTTPException
 from odmantic import AIOEngine
 
 from app.auth.models import UserBase
+from app.core.cache import LRUCache
 from app.core.config import settings
 from app.core.services import get_db
-from app.auth.selectors import get_user_by_id
+from app.auth.selectors import get_cached_user_by_id
+from app.auth.revocation import revocation_list
 
 
 def _get_authorization_token(request: Request) -> str:
@@ -26,8 +31,12 @@ async def _get_current_user(
     token: str = Depends(_get_authorization_token),
     engine: AIOEngine = Depends(get_db),
 ) -> UserBase:
-    user_id = decode_access_token(token)
-    user = await get_user_by_id(engine, user_id)
+    payload = decode_access_token(token)
+    if revocation_list.is_revoked(payload.get("jti")):
+        raise HTTPException(
+            status_code=HTTPStatus.UNAUTHORIZED, detail="Token has been revoked"
+        )
+    user = await get_cached_user_by_id(engine, payload["user_id"])
     if not user:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="User not found")
     return user
@@ -45,7 +54,7 @@ async def _get_current_user_optional(
     token: str = Depends(_get_authorization_token_optional),
 ) -> Optional[UserBase]:
     if token:
-        return await _get_current_user(engine, token)
+        return await _get_current_user(token, engine)
     return None
 
 
@@ -56,25 +65,42 @@ def get_current_user_authorizer(*, required: bool = True) -> Optional[UserBase]:
         return _get_current_user_optional
 
 
-def create_access_token(id: str) -> str:
+def _key_ring() -> Dict[str, str]:
+    keys = dict(settings.PREVIOUS_SECRET_KEYS)
+    keys[settings.SECRET_KEY_ID] = settings.SECRET_KEY
+    return keys
+
+
+# verification keys by kid, the current key signs
+key_ring = _key_ring()
+
+# access token payloads by token digest, kept until the token expires
+token_cache = LRUCache(maxsize=settings.TOKEN_CACHE_SIZE)
+
+
+def _encode_token(id: str, expire_seconds: int) -> str:
     return jwt.encode(
         {
             "user_id": id,
             "exp": datetime.datetime.utcnow()
-            + datetime.timedelta(seconds=settings.ACCESS_TOKEN_EXPIRE_SECONDS),
+            + datetime.timedelta(seconds=expire_seconds),
             "iat": datetime.datetime.utcnow(),
+            # unique per token, revocation and rotation key on it
+            "jti": uuid.uuid4().hex,
         },
         settings.SECRET_KEY,
         algorithm=settings.JWT_ALGORITHM,
+        headers={"kid": settings.SECRET_KEY_ID},
     )
 
 
-def decode_access_token(token: str):
+def _decode_token(token: str) -> Dict[str, Any]:
     try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=settings.JWT_ALGORITHM
-        )
-        return payload["user_id"]
+        # tokens signed before key ids were introduced use the current key
+        kid = jwt.get_unverified_header(token).get("kid", settings.SECRET_KEY_ID)
+        if kid not in key_ring:
+            raise PyJWTError("Unknown key id")
+        return jwt.decode(token, key_ring[kid], algorithms=[settings.JWT_ALGORITHM])
     except PyJWTError:
         raise HTTPException(
             status_code=HTTPStatus.UNAUTHORIZED,
@@ -82,27 +108,22 @@ def decode_access_token(token: str):
         )
 
 
+def create_access_token(id: str) -> str:
+    return _encode_token(id, settings.ACCESS_TOKEN_EXPIRE_SECONDS)
+
+
+def decode_access_token(token: str) -> Dict[str, Any]:
+    digest = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(digest)
+    if payload is None:
+        payload = _decode_token(token)
+        token_cache.set(digest, payload, ttl=payload["exp"] - time.time())
+    return payload
+
+
 def create_refresh_token(id: str):
-    return jwt.encode(
-        {
-            "user_id": id,
-            "exp": datetime.datetime.utcnow()
-            + datetime.timedelta(seconds=settings.REFRESH_TOKEN_EXPIRE_SECONDS),
-            "iat": datetime.datetime.utcnow(),
-        },
-        settings.SECRET_KEY,
-        algorithm=settings.JWT_ALGORITHM,
-    )
+    return _encode_token(id, settings.REFRESH_TOKEN_EXPIRE_SECONDS)
 
 
 def decode_refresh_token(token: str):
-    try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=settings.JWT_ALGORITHM
-        )
-        return payload["user_id"]
-    except PyJWTError:
-        raise HTTPException(
-            status_code=HTTPStatus.UNAUTHORIZED,
-            detail="Could not validate credentials",
-        )
+    return _decode_token(token)["user_id"]
@@ -1,17 +1,183 @@
+import hashlib
+import datetime
+from http import HTTPStatus
+from functools import partial
+from typing import Any, Dict, Hashable, Callable, Awaitable
+
+import orjson
+from fastapi import Request, Response
 from odmantic import AIOEngine
+from odmantic.bson import BSON_TYPES_ENCODERS, ObjectId
 from pydantic import BaseModel
-from fastapi.encoders import jsonable_encoder
+from pydantic.json import custom_pydantic_encoder
+from pymongo import monitoring
 from fastapi.responses import JSONResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 
+from app.core.cache import LRUCache
 from app.core.config import settings
+from app.core.metrics import command_metrics
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Collect connection pool usage, used to size the Mongo pool"""
+
+    def __init__(self) -> None:
+        self.open = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_pool_size": settings.MONGO_MAX_POOL_SIZE,
+            "min_pool_size": settings.MONGO_MIN_POOL_SIZE,
+            "open": self.open,
+            "checked_out": self.checked_out,
+            "available": max(self.open - self.checked_out, 0),
+            "checkouts": self.checkouts,
+            "checkout_failures": self.checkout_failures,
+            "wait_time_avg_ms": (
+                self.wait_time_total / self.checkouts * 1000 if self.checkouts else 0.0
+            ),
+            "wait_time_max_ms": self.wait_time_max * 1000,
+        }
+
+    def _record_wait(self, event) -> None:
+        # ``duration`` is only reported by pymongo >= 4.7
+        duration = getattr(event, "duration", None)
+        if duration is not None:
+            self.wait_time_total += duration
+            self.wait_time_max = max(self.wait_time_max, duration)
+
+    def connection_created(self, event) -> None:
+        self.open += 1
+
+    def connection_closed(self, event) -> None:
+        self.open = max(self.open - 1, 0)
+
+    def connection_checked_out(self, event) -> None:
+        self.checked_out += 1
+        self.checkouts += 1
+        self._record_wait(event)
+
+    def connection_checked_in(self, event) -> None:
+        self.checked_out = max(self.checked_out - 1, 0)
+
+    def connection_check_out_failed(self, event) -> None:
+        self.checkout_failures += 1
+        self._record_wait(event)
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        pass
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_check_out_started(self, event) -> None:
+        pass
+
+
+pool_stats = PoolStatsListener()
+
+
+def create_mongo_client() -> AsyncIOMotorClient:
+    """Create a pooled Mongo client, one per worker process"""
+    return AsyncIOMotorClient(
+        str(settings.MONGODB_URL),
+        maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+        minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=settings.MONGO_MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        event_listeners=[pool_stats, command_metrics],
+    )
+
+
+def create_engine(client: AsyncIOMotorClient) -> AIOEngine:
+    return AIOEngine(client=client, database=settings.database_name)
+
+
+async def get_db(request: Request) -> AIOEngine:
+    return request.app.state.engine
+
+
+# types orjson does not serialize natively
+_default_encoder = partial(
+    custom_pydantic_encoder, {**BSON_TYPES_ENCODERS, ObjectId: str}
+)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered by orjson, the default response class"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content, default=_default_encoder, option=orjson.OPT_NON_STR_KEYS
+        )
+
+
+def render_model(model: BaseModel) -> bytes:
+    """Serialize a model like ``model.json(by_alias=True)``, with orjson"""
+    encoders = {**BSON_TYPES_ENCODERS, ObjectId: str, **model.__config__.json_encoders}
+    option = orjson.OPT_NON_STR_KEYS
+    if datetime.datetime in encoders:
+        # the model formats its own datetimes, e.g. as timestamps
+        option |= orjson.OPT_PASSTHROUGH_DATETIME
+    return orjson.dumps(
+        model.dict(by_alias=True),
+        default=partial(custom_pydantic_encoder, encoders),
+        option=option,
+    )
+
+
+def create_aliased_response(
+    model: BaseModel, status_code: int = HTTPStatus.OK
+) -> Response:
+    """Serve an already valid model, skipping response_model validation"""
+    return Response(
+        content=render_model(model),
+        status_code=status_code,
+        media_type="application/json",
+    )
 
 
-async def get_db():
-    client = AsyncIOMotorClient(settings.MONGODB_URL)
-    engine = AIOEngine(client=client, database=settings.database_name)
-    return engine
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
 
 
-def create_aliased_response(model: BaseModel) -> JSONResponse:
-    return JSONResponse(content=jsonable_encoder(model, by_alias=True))
+async def cached_json_response(
+    request: Request,
+    cache: LRUCache,
+    key: Hashable,
+    build: Callable[[], Awaitable[BaseModel]],
+) -> Response:
+    """Serve a JSON body from cache with ETag, answer 304 when it matches"""
+    entry = cache.get(key)
+    if entry is None:
+        model = await build()
+        body = render_model(model)
+        entry = (body, '"{}"'.format(hashlib.sha1(body).hexdigest()))
+        cache.set(key, entry)
+    body, etag = entry
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.RESPONSE_CACHE_MAX_AGE}",
+    }
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,45 @@
+from app.core.cache import LRUCache
+from app.core.config import settings
+
+
+def _response_size(entry) -> int:
+    body, _ = entry
+    return len(body)
+
+
+# (body, etag) of /feed/ pages keyed by the normalized filters
+feed_cache = LRUCache(
+    maxsize=settings.RESPONSE_CACHE_SIZE,
+    ttl=settings.RESPONSE_CACHE_TTL_SECONDS,
+    maxbytes=settings.RESPONSE_CACHE_MAX_BYTES,
+    sizeof=_response_size,
+)
+
+# (body, etag) of /feed/{slug} keyed by slug
+property_cache = LRUCache(
+    maxsize=settings.RESPONSE_CACHE_SIZE,
+    ttl=settings.RESPONSE_CACHE_TTL_SECONDS,
+    maxbytes=settings.RESPONSE_CACHE_MAX_BYTES,
+    sizeof=_response_size,
+)
+
+
+# total feed counts keyed by the filters without pagination
+count_cache = LRUCache(
+    maxsize=settings.FEED_COUNT_CACHE_SIZE, ttl=settings.FEED_COUNT_CACHE_TTL_SECONDS
+)
+
+
+# feed sidebar facet counts keyed by the filters without pagination
+facet_cache = LRUCache(
+    maxsize=settings.FEED_COUNT_CACHE_SIZE, ttl=settings.FEED_COUNT_CACHE_TTL_SECONDS
+)
+
+
+def invalidate_listings(slug: str = "") -> None:
+    """Drop cached responses a listing write can change"""
+    feed_cache.clear()
+    count_cache.clear()
+    facet_cache.clear()
+    if slug:
+        property_cache.pop(slug)
@@ -1,12 +1,12 @@
 import enum
-from typing import List, Optional
-from datetime import datetime
+from typing import Any, Dict, List, Optional
+from datetime import date, datetime, timezone
 
-from pydantic import AnyUrl, BaseModel, Field
+from pydantic import AnyUrl, BaseModel, Field, validator
 
 from app.core.model import BaseModelClass
 from app.auth.models import UserBase
-from odmantic import Model, EmbeddedModel, ObjectId
+from odmantic import Model, EmbeddedModel, ObjectId, Field as ModelField
 
 
 class PropertyType(str, enum.Enum):
@@ -21,11 +21,33 @@ class PropertyType(str, enum.Enum):
     type_car = "Car"
 
 
+class FeedView(str, enum.Enum):
+    view_full = "full"
+    view_card = "card"
+
+
+class ExportFormat(str, enum.Enum):
+    format_ndjson = "ndjson"
+    format_csv = "csv"
+
+
 class PropertyFilterParams(BaseModel):
     type: str = ""
+    types: List[str] = []
     owner: str = ""
+    city: str = ""
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    is_active: Optional[bool] = None
     limit: int = 20
     offset: int = 0
+    cursor: str = ""
+
+    def cache_key(self) -> tuple:
+        return tuple(
+            (name, tuple(sorted(value)) if isinstance(value, list) else value)
+            for name, value in sorted(self.dict().items())
+        )
 
 
 class Address(EmbeddedModel):
@@ -54,7 +76,37 @@ class ReservationModel(BaseModel):
 
 
 class Reservation(Model, BaseModelClass, ReservationModel):
-    pass
+    # odmantic only stores the fields declared on the model class itself
+    property_id: str
+    body: str = ""
+    date_start: datetime
+    date_end: datetime
+    username: str = ""
+
+
+class ReservationInCreate(BaseModel):
+    date_start: datetime
+    date_end: datetime
+    body: str = ""
+
+    @validator("date_start", "date_end")
+    def to_naive_utc(cls, v: datetime) -> datetime:
+        # stored and compared as naive UTC, like the rest of the dates
+        if v.tzinfo:
+            return v.astimezone(timezone.utc).replace(tzinfo=None)
+        return v
+
+    @validator("date_end")
+    def check_date_end(cls, v: datetime, values) -> datetime:
+        if "date_start" in values and v <= values["date_start"]:
+            raise ValueError("date_end must be after date_start")
+        return v
+
+
+class AvailabilityInResponse(BaseModel):
+    date_start: date
+    date_end: date
+    occupied: List[bool]
 
 
 class ReservationInUpdate(BaseModel):
@@ -80,6 +132,14 @@ class PropertyBase(BaseModel):
     price: float
     property_type: PropertyType = PropertyType.type_house
     address: Address
+    feature_image: Optional[AnyUrl] = None
+
+    @classmethod
+    def from_property(cls, property: "Property") -> "PropertyBase":
+        """Public fields of a stored property, trusted so not validated"""
+        return cls.construct(
+            **{field: getattr(property, field) for field in cls.__fields__}
+        )
 
 
 class Property(Model, BaseModelClass):
@@ -91,14 +151,19 @@ class Property(Model, BaseModelClass):
     price: float
     property_type: PropertyType = PropertyType.type_house
     address: Address
+    feature_image: Optional[AnyUrl] = None
+    # declared again, odmantic only stores the fields of the model class itself
+    created_at: datetime = ModelField(default_factory=datetime.utcnow)
+    updated_at: datetime = ModelField(default_factory=datetime.utcnow)
 
 
 class PropertyInCreate(BaseModel):
     title: str
     description: str
-    price: float
+    price: float = Field(..., ge=0)
     property_type: PropertyType
     address: Address
+    feature_image: Optional[AnyUrl] = None
     # media: List[MediaModel]
 
 
@@ -110,12 +175,76 @@ class PropertyInResponse(BaseModel):
 class ManyPropertiesInResponse(BaseModel):
     properties: List[PropertyBase]
     properties_count: int = Field(..., alias="properties_count")
+    next_cursor: Optional[str] = None
+
+
+class PropertyCard(BaseModel):
+    title: str
+    slug: str
+    price: float
+    property_type: PropertyType
+    city: str
+    feature_image: Optional[AnyUrl] = None
+
+    @classmethod
+    def from_doc(cls, doc: Dict[str, Any]) -> "PropertyCard":
+        """Build from a projected Mongo document, trusted so not validated"""
+        return cls.construct(
+            title=doc["title"],
+            slug=doc["slug"],
+            price=doc["price"],
+            property_type=doc["property_type"],
+            city=doc["address"]["city"],
+            feature_image=doc.get("feature_image"),
+        )
+
+
+class ManyPropertyCardsInResponse(BaseModel):
+    properties: List[PropertyCard]
+    properties_count: int = Field(..., alias="properties_count")
+    next_cursor: Optional[str] = None
+
+
+class ImportStatus(str, enum.Enum):
+    status_created = "created"
+    status_invalid = "invalid"
+    status_failed = "failed"
+
+
+class PropertyImportResult(BaseModel):
+    index: int
+    status: ImportStatus
+    slug: Optional[str] = None
+    error: Optional[str] = None
+
+
+class PropertiesImportResponse(BaseModel):
+    results: List[PropertyImportResult]
+    created_count: int = 0
+    failed_count: int = 0
+
+
+class FacetCount(BaseModel):
+    value: str
+    count: int
+
+
+class PriceBucket(BaseModel):
+    min_price: float
+    max_price: Optional[float] = None
+    count: int
+
+
+class PropertyFacetsInResponse(BaseModel):
+    property_type: List[FacetCount]
+    city: List[FacetCount]
+    price: List[PriceBucket]
 
 
 class PropertyInUpdate(BaseModel):
     title: Optional[str] = None
     description: Optional[str] = None
-    price: Optional[float] = None
+    price: Optional[float] = Field(None, ge=0)
     is_active: Optional[bool] = True
     property_type: Optional[PropertyType] = None
     address: Optional[Address] = None
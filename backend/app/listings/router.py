@@ -1,50 +1,156 @@
+import asyncio
 from http import HTTPStatus
-from typing import Any, Optional
+from typing import Any, List, Union, Optional
+from datetime import date
 
-from fastapi import Body, Depends, APIRouter, HTTPException, Query, Path
+from fastapi import Body, Depends, Request, APIRouter, HTTPException, Query, Path
+from fastapi.responses import StreamingResponse
 from odmantic import AIOEngine
+from pydantic import ValidationError
 from app.auth.models import UserBase
 from app.listings.models import (
+    AvailabilityInResponse,
     Media,
     MediaModel,
+    ExportFormat,
+    FeedView,
+    ImportStatus,
     ManyPropertiesInResponse,
+    ManyPropertyCardsInResponse,
     Property,
     PropertyBase,
+    PropertyCard,
+    PropertyFacetsInResponse,
+    PropertyImportResult,
+    PropertiesImportResponse,
     PropertyFilterParams,
     PropertyInCreate,
     PropertyInResponse,
+    ReservationInCreate,
+    ReservationInResponse,
     PropertyType,
 )
 
 from app.core.security import get_current_user_authorizer
-from app.core.services import get_db
+from app.core.services import get_db, cached_json_response, create_aliased_response
+from app.listings.cache import feed_cache, property_cache
+from app.core.config import settings
 from app.listings.selectors import (
-    all_property_reservation,
+    count_properties,
+    count_search_results,
+    get_occupied_days,
     get_properties,
     get_property_by_slug,
+    get_property_cards,
+    get_property_facets,
+    iter_properties,
+    search_property_cards,
+    get_property_with_reservations,
+)
+from app.listings.services import (
+    cancel_reservation,
+    check_export_permission,
+    check_user_permission,
+    create_property,
+    create_reservation,
+    import_properties,
+)
+from app.listings.utils import (
+    EXPORT_FIELDS,
+    iter_ndjson_lines,
+    to_csv_line,
+    to_ndjson_line,
+    flatten_export_doc,
+    decode_feed_cursor,
+    encode_feed_cursor,
+    document_created_at,
 )
-from app.listings.services import check_user_permission, create_property
 
 router = APIRouter(prefix="/feed")
 
 
+def get_feed_filters(
+    owner: str = "",
+    type: PropertyType = "",
+    types: List[PropertyType] = Query([]),
+    city: str = "",
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    is_active: Optional[bool] = None,
+) -> PropertyFilterParams:
+    """Filters shared by the feed, its facets and the export"""
+    return PropertyFilterParams(
+        type=type,
+        types=types,
+        owner=owner,
+        city=city,
+        min_price=min_price,
+        max_price=max_price,
+        is_active=is_active,
+    )
+
+
 @router.get(
     "/",
-    response_model=ManyPropertiesInResponse,
+    response_model=Union[ManyPropertiesInResponse, ManyPropertyCardsInResponse],
     status_code=HTTPStatus.OK,
 )
 async def get_properties_feed(
+    request: Request,
     limit: int = Query(20, gt=0),
     offset: int = Query(0, ge=0),
-    owner: str = "",
-    type: PropertyType = "",
+    cursor: str = "",
+    view: FeedView = FeedView.view_full,
+    filters: PropertyFilterParams = Depends(get_feed_filters),
     engine: AIOEngine = Depends(get_db),
 ) -> Any:
-    """Feed properties"""
-    filters = PropertyFilterParams(type=type, owner=owner, limit=limit, offset=offset)
-    properties = await get_properties(engine, filters)
-    return ManyPropertiesInResponse(
-        properties=properties, properties_count=len(properties)
+    """Feed properties, pass `next_cursor` back as `cursor` to get the next page.
+
+    `view=card` returns only the fields needed to render a listing card.
+    """
+    filters = filters.copy(update={"limit": limit, "offset": offset, "cursor": cursor})
+    if cursor:
+        try:
+            decode_feed_cursor(cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=HTTPStatus.BAD_REQUEST, detail="Invalid cursor"
+            )
+
+    async def build_full() -> ManyPropertiesInResponse:
+        properties, properties_count = await asyncio.gather(
+            get_properties(engine, filters), count_properties(engine, filters)
+        )
+        next_cursor = None
+        if len(properties) == limit:
+            last = properties[-1]
+            next_cursor = encode_feed_cursor(last.created_at, last.id)
+        return ManyPropertiesInResponse.construct(
+            # owner and bookkeeping fields stay private
+            properties=[
+                PropertyBase.from_property(property) for property in properties
+            ],
+            properties_count=properties_count,
+            next_cursor=next_cursor,
+        )
+
+    async def build_cards() -> ManyPropertyCardsInResponse:
+        documents, properties_count = await asyncio.gather(
+            get_property_cards(engine, filters), count_properties(engine, filters)
+        )
+        next_cursor = None
+        if len(documents) == limit:
+            last = documents[-1]
+            next_cursor = encode_feed_cursor(document_created_at(last), last["_id"])
+        return ManyPropertyCardsInResponse.construct(
+            properties=[PropertyCard.from_doc(document) for document in documents],
+            properties_count=properties_count,
+            next_cursor=next_cursor,
+        )
+
+    build = build_cards if view == FeedView.view_card else build_full
+    return await cached_json_response(
+        request, feed_cache, (view, filters.cache_key()), build
     )
 
 
@@ -68,25 +174,274 @@ async def new_property(
     )
 
 
+@router.get(
+    "/facets",
+    response_model=PropertyFacetsInResponse,
+    status_code=HTTPStatus.OK,
+)
+async def get_feed_facets(
+    filters: PropertyFilterParams = Depends(get_feed_filters),
+    engine: AIOEngine = Depends(get_db),
+) -> Any:
+    """Counts per property type, city and price range for the feed sidebar"""
+    facets = await get_property_facets(engine, filters)
+    return create_aliased_response(PropertyFacetsInResponse.construct(**facets))
+
+
+@router.get(
+    "/search",
+    response_model=ManyPropertyCardsInResponse,
+    status_code=HTTPStatus.OK,
+)
+async def search_properties(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, gt=0, le=settings.SEARCH_MAX_LIMIT),
+    offset: int = Query(0, ge=0, le=settings.SEARCH_MAX_OFFSET),
+    engine: AIOEngine = Depends(get_db),
+) -> Any:
+    """Keyword search on title and description, ranked by relevance"""
+    text = " ".join(q.split())
+
+    async def build() -> ManyPropertyCardsInResponse:
+        documents, properties_count = await asyncio.gather(
+            search_property_cards(engine, text, limit, offset),
+            count_search_results(engine, text),
+        )
+        return ManyPropertyCardsInResponse.construct(
+            properties=[PropertyCard.from_doc(document) for document in documents],
+            properties_count=properties_count,
+            next_cursor=None,
+        )
+
+    return await cached_json_response(
+        request, feed_cache, ("search", text, limit, offset), build
+    )
+
+
+@router.post(
+    "/import",
+    response_model=PropertiesImportResponse,
+    status_code=HTTPStatus.OK,
+)
+async def import_properties_batch(
+    request: Request,
+    engine: AIOEngine = Depends(get_db),
+    user: Optional[UserBase] = Depends(get_current_user_authorizer()),
+) -> Any:
+    """Bulk create properties from a JSON array or an NDJSON stream.
+
+    Every item gets a result with its index, the created slug or the error.
+    """
+    await check_user_permission(engine, user)
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        raw_items = iter_ndjson_lines(request.stream())
+    else:
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        if not isinstance(body, list):
+            raise HTTPException(
+                status_code=HTTPStatus.BAD_REQUEST,
+                detail="Expected a JSON array or an NDJSON body",
+            )
+        if len(body) > settings.IMPORT_MAX_ITEMS:
+            raise HTTPException(
+                status_code=HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                detail=f"At most {settings.IMPORT_MAX_ITEMS} properties per import",
+            )
+
+        async def iter_body():
+            for item in body:
+                yield item
+
+        raw_items = iter_body()
+
+    results, batch, index = [], [], 0
+    async for raw_item in raw_items:
+        if index >= settings.IMPORT_MAX_ITEMS:
+            results.append(
+                PropertyImportResult(
+                    index=index,
+                    status=ImportStatus.status_failed,
+                    error="Import limit exceeded, remaining items skipped",
+                )
+            )
+            break
+        try:
+            if isinstance(raw_item, bytes):
+                property = PropertyInCreate.parse_raw(raw_item)
+            else:
+                property = PropertyInCreate.parse_obj(raw_item)
+            batch.append((index, property))
+        except ValidationError as exc:
+            results.append(
+                PropertyImportResult(
+                    index=index, status=ImportStatus.status_invalid, error=str(exc)
+                )
+            )
+        if len(batch) >= settings.IMPORT_BATCH_SIZE:
+            results.extend(await import_properties(engine, batch, user))
+            batch = []
+        index += 1
+    if batch:
+        results.extend(await import_properties(engine, batch, user))
+
+    results.sort(key=lambda result: result.index)
+    created_count = sum(
+        result.status == ImportStatus.status_created for result in results
+    )
+    return create_aliased_response(
+        PropertiesImportResponse.construct(
+            results=results,
+            created_count=created_count,
+            failed_count=len(results) - created_count,
+        )
+    )
+
+
+@router.get("/export", status_code=HTTPStatus.OK)
+async def export_properties(
+    format: ExportFormat = ExportFormat.format_ndjson,
+    batch_size: int = Query(settings.EXPORT_BATCH_SIZE, gt=0, le=10_000),
+    filters: PropertyFilterParams = Depends(get_feed_filters),
+    engine: AIOEngine = Depends(get_db),
+    user: Optional[UserBase] = Depends(get_current_user_authorizer()),
+) -> Any:
+    """Stream all properties matching the filters as NDJSON or CSV"""
+    await check_export_permission(user)
+    projection = {field: 1 for field in EXPORT_FIELDS}
+
+    async def rows():
+        if format == ExportFormat.format_csv:
+            yield to_csv_line(EXPORT_FIELDS)
+        async for document in iter_properties(engine, filters, batch_size, projection):
+            row = flatten_export_doc(document)
+            if format == ExportFormat.format_csv:
+                yield to_csv_line(row)
+            else:
+                yield to_ndjson_line(row)
+
+    if format == ExportFormat.format_csv:
+        media_type, filename = "text/csv", "properties.csv"
+    else:
+        media_type, filename = "application/x-ndjson", "properties.ndjson"
+    return StreamingResponse(
+        rows(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @router.get(
     "/{slug}",
     status_code=HTTPStatus.OK,
     response_model=PropertyInResponse,
 )
 async def get_property(
+    request: Request,
     engine: AIOEngine = Depends(get_db),
     slug: str = Path(..., min_length=1),
     user: Optional[UserBase] = Depends(get_current_user_authorizer(required=False)),
 ) -> Any:
     """Get property by slug"""
+
+    async def build() -> PropertyInResponse:
+        result = await get_property_with_reservations(
+            engine, slug, settings.PROPERTY_RESERVATIONS_LIMIT
+        )
+        if not result:
+            raise HTTPException(
+                status_code=HTTPStatus.NOT_FOUND,
+                detail=f"Property with slug '{slug}' not found",
+            )
+        property, reservations = result
+        return PropertyInResponse(property=property, reservations=reservations)
+
+    return await cached_json_response(request, property_cache, slug, build)
+
+
+@router.post(
+    "/{slug}/reservations",
+    response_model=ReservationInResponse,
+    status_code=HTTPStatus.CREATED,
+)
+async def new_reservation(
+    engine: AIOEngine = Depends(get_db),
+    slug: str = Path(..., min_length=1),
+    reservation: ReservationInCreate = Body(..., embed=True),
+    user: Optional[UserBase] = Depends(get_current_user_authorizer()),
+) -> Any:
+    """Book a property, 409 if the dates overlap an existing reservation.
+
+    503 with Retry-After if the property stays locked by other bookings.
+    """
     property = await get_property_by_slug(engine, slug)
     if not property:
         raise HTTPException(
             status_code=HTTPStatus.NOT_FOUND,
             detail=f"Property with slug '{slug}' not found",
         )
-    reservations = await all_property_reservation(engine, slug)
-    return PropertyInResponse(property=property, reservations=reservations)
+    if not property.is_active:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST, detail="Property is not available"
+        )
+    new_reservation = await create_reservation(engine, property, reservation, user)
+    return ReservationInResponse(
+        **new_reservation.dict(), reservation_id=str(new_reservation.id)
+    )
+
+
+@router.delete(
+    "/{slug}/reservations/{reservation_id}",
+    status_code=HTTPStatus.NO_CONTENT,
+)
+async def delete_reservation(
+    engine: AIOEngine = Depends(get_db),
+    slug: str = Path(..., min_length=1),
+    reservation_id: str = Path(..., min_length=1),
+    user: Optional[UserBase] = Depends(get_current_user_authorizer()),
+) -> None:
+    """Cancel a reservation, frees its days in the availability calendar"""
+    property = await get_property_by_slug(engine, slug)
+    if not property:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND,
+            detail=f"Property with slug '{slug}' not found",
+        )
+    await cancel_reservation(engine, property, reservation_id, user)
+
+
+@router.get(
+    "/{slug}/availability",
+    response_model=AvailabilityInResponse,
+    status_code=HTTPStatus.OK,
+)
+async def get_availability(
+    date_start: date,
+    date_end: date,
+    engine: AIOEngine = Depends(get_db),
+    slug: str = Path(..., min_length=1),
+) -> Any:
+    """Day by day occupancy of a property for [date_start, date_end)"""
+    days = (date_end - date_start).days
+    if days <= 0 or days > settings.AVAILABILITY_MAX_DAYS:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail=f"date_end must be 1 to {settings.AVAILABILITY_MAX_DAYS} days "
+            "after date_start",
+        )
+    property = await get_property_by_slug(engine, slug)
+    if not property:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND,
+            detail=f"Property with slug '{slug}' not found",
+        )
+    occupied = await get_occupied_days(engine, str(property.id), date_start, date_end)
+    return AvailabilityInResponse(
+        date_start=date_start, date_end=date_end, occupied=occupied
+    )
 
 
 # @router.put(
@@ -1,4 +1,5 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Tuple, Iterable, Optional, AsyncIterator
+from datetime import date, datetime
 
 
 from app.auth.models import UserBase
@@ -8,40 +9,314 @@ from app.listings.models import (
     Reservation,
     ReservationModel,
     PropertyFilterParams,
+    ReservationInResponse,
 )
+from app.core.config import settings
+from app.listings.cache import count_cache, facet_cache
+from app.listings.utils import get_day_bits, decode_feed_cursor, split_days_by_year
 from odmantic import AIOEngine, query
+from pymongo import DESCENDING
 
+# per property and year occupancy bitmap,
+# {"_id": "<property_id>:<year>", "property_id", "year", "bits": 46 bytes}
+AVAILABILITY_COLLECTION = "availability"
 
-async def get_properties(
-    engine: AIOEngine, filters: PropertyFilterParams
-) -> Optional[List[PropertyBase]]:
-    """Get feed properties"""
+FEED_SORT = [("created_at", DESCENDING), ("_id", DESCENDING)]
+
+# fields of a feed card, plus the keyset pagination key
+CARD_PROJECTION = {
+    "title": 1,
+    "slug": 1,
+    "price": 1,
+    "property_type": 1,
+    "address.city": 1,
+    "feature_image": 1,
+    "created_at": 1,
+}
+
+
+# filters the sidebar facets count over, each facet ignores its own filter
+FACET_FILTERS = ("type", "city", "price")
 
+
+def build_feed_query(
+    filters: PropertyFilterParams, exclude: Iterable[str] = ()
+) -> Dict[str, Any]:
+    """Build the Mongo filter of the feed, including the keyset position"""
     base_query = {}
     if filters.owner:
         base_query["owner.username"] = filters.owner
-    if filters.type:
-        base_query["property_type"] = filters.type
+    types = set(filters.types) | ({filters.type} if filters.type else set())
+    if types and "type" not in exclude:
+        if len(types) == 1:
+            base_query["property_type"] = types.pop()
+        else:
+            base_query["property_type"] = {"$in": sorted(types)}
+    if filters.city and "city" not in exclude:
+        base_query["address.city"] = filters.city
+    price_range = {}
+    if filters.min_price is not None:
+        price_range["$gte"] = filters.min_price
+    if filters.max_price is not None:
+        price_range["$lte"] = filters.max_price
+    if price_range and "price" not in exclude:
+        base_query["price"] = price_range
+    if filters.is_active is not None:
+        base_query["is_active"] = filters.is_active
+    if filters.cursor:
+        created_at, id = decode_feed_cursor(filters.cursor)
+        base_query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": id}},
+        ]
+    return base_query
+
+
+async def get_properties(
+    engine: AIOEngine, filters: PropertyFilterParams
+) -> Optional[List[Property]]:
+    """Get feed properties, newest first"""
     properties = await engine.find(
         Property,
-        base_query,
+        build_feed_query(filters),
         limit=filters.limit,
-        skip=filters.offset,
-        # sort=query.asc(Property.created_at),
+        # keyset pages seek on (created_at, _id), offset is kept for old clients
+        skip=0 if filters.cursor else filters.offset,
+        sort=(query.desc(Property.created_at), query.desc(Property.id)),
     )
     return properties
 
 
+async def count_properties(engine: AIOEngine, filters: PropertyFilterParams) -> int:
+    """Count all feed properties matching the filters, cached for a short ttl"""
+    filters = filters.copy(update={"limit": 0, "offset": 0, "cursor": ""})
+    key = filters.cache_key()
+    count = count_cache.get(key)
+    if count is None:
+        collection = engine.get_collection(Property)
+        base_query = build_feed_query(filters)
+        if base_query:
+            count = await collection.count_documents(base_query)
+        else:
+            # collection metadata, no scan, may be off after an unclean shutdown
+            count = await collection.estimated_document_count()
+        count_cache.set(key, count)
+    return count
+
+
+async def get_property_facets(
+    engine: AIOEngine, filters: PropertyFilterParams
+) -> Dict[str, Any]:
+    """Type, city and price counts for the feed sidebar in one $facet"""
+    filters = filters.copy(update={"limit": 0, "offset": 0, "cursor": ""})
+    key = filters.cache_key()
+    facets = facet_cache.get(key)
+    if facets is not None:
+        return facets
+
+    facet_filters = PropertyFilterParams(
+        type=filters.type,
+        types=filters.types,
+        city=filters.city,
+        min_price=filters.min_price,
+        max_price=filters.max_price,
+    )
+    pipeline = [
+        {"$match": build_feed_query(filters, exclude=FACET_FILTERS)},
+        {
+            "$facet": {
+                "property_type": [
+                    {"$match": build_feed_query(facet_filters, exclude=["type"])},
+                    {"$sortByCount": "$property_type"},
+                ],
+                "city": [
+                    {"$match": build_feed_query(facet_filters, exclude=["city"])},
+                    {"$sortByCount": "$address.city"},
+                    {"$limit": settings.FACET_CITY_LIMIT},
+                ],
+                "price": [
+                    {"$match": build_feed_query(facet_filters, exclude=["price"])},
+                    {
+                        "$bucket": {
+                            "groupBy": "$price",
+                            # the last bucket is open ended
+                            "boundaries": [
+                                *settings.FACET_PRICE_BOUNDARIES,
+                                float("inf"),
+                            ],
+                            # below the first boundary, no price filter selects it
+                            "default": "other",
+                        }
+                    },
+                ],
+            }
+        },
+    ]
+    cursor = engine.get_collection(Property).aggregate(pipeline)
+    (result,) = await cursor.to_list(length=1)
+    boundaries = settings.FACET_PRICE_BOUNDARIES
+    facets = {
+        "property_type": [
+            {"value": bucket["_id"], "count": bucket["count"]}
+            for bucket in result["property_type"]
+        ],
+        "city": [
+            {"value": bucket["_id"], "count": bucket["count"]}
+            for bucket in result["city"]
+        ],
+        "price": [
+            {
+                "min_price": bucket["_id"],
+                "max_price": next((b for b in boundaries if b > bucket["_id"]), None),
+                "count": bucket["count"],
+            }
+            for bucket in result["price"]
+            if bucket["_id"] != "other"
+        ],
+    }
+    facet_cache.set(key, facets)
+    return facets
+
+
+async def get_property_cards(
+    engine: AIOEngine, filters: PropertyFilterParams
+) -> List[Dict[str, Any]]:
+    """Get feed properties as projected card documents, newest first"""
+    cursor = (
+        engine.get_collection(Property)
+        .find(build_feed_query(filters), CARD_PROJECTION)
+        .sort(FEED_SORT)
+        .skip(0 if filters.cursor else filters.offset)
+        .limit(filters.limit)
+    )
+    return await cursor.to_list(length=filters.limit)
+
+
+def build_search_query(text: str) -> Dict[str, Any]:
+    return {"$text": {"$search": text}}
+
+
+async def search_property_cards(
+    engine: AIOEngine, text: str, limit: int, offset: int
+) -> List[Dict[str, Any]]:
+    """Full-text search on title and description, best matches first"""
+    score = {"$meta": "textScore"}
+    cursor = (
+        engine.get_collection(Property)
+        .find(build_search_query(text), {**CARD_PROJECTION, "score": score})
+        .sort([("score", score)])
+        .skip(offset)
+        .limit(limit)
+    )
+    return await cursor.to_list(length=limit)
+
+
+async def count_search_results(engine: AIOEngine, text: str) -> int:
+    """Count full-text search matches, cached like the feed counts"""
+    key = ("search", text)
+    count = count_cache.get(key)
+    if count is None:
+        count = await engine.get_collection(Property).count_documents(
+            build_search_query(text)
+        )
+        count_cache.set(key, count)
+    return count
+
+
+async def iter_properties(
+    engine: AIOEngine,
+    filters: PropertyFilterParams,
+    batch_size: int,
+    projection: Optional[Dict[str, int]] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Iterate raw property documents, fetched batch_size at a time"""
+    cursor = (
+        engine.get_collection(Property)
+        .find(build_feed_query(filters), projection)
+        .batch_size(batch_size)
+    )
+    async for document in cursor:
+        yield document
+
+
 async def get_property_by_slug(engine: AIOEngine, slug: str) -> Optional[Property]:
     """Get property by slug"""
     property = await engine.find_one(Property, Property.slug == slug)
     return property
 
 
-async def all_property_reservation(
-    engine: AIOEngine, slug: str
-) -> Optional[List[Reservation]]:
-    """Get all reservation for existing property"""
-    property = await get_property_by_slug(engine, slug)
-    reservations = engine.find(Reservation, Reservation.property_id == property.id)
-    return reservations
+async def get_overlapping_reservation(
+    engine: AIOEngine, property_id: str, date_start: datetime, date_end: datetime
+) -> Optional[Dict[str, Any]]:
+    """Get a reservation overlapping [date_start, date_end), if any.
+
+    Reservations of a property never overlap each other, so only the last one
+    starting before date_end can overlap: a single index seek.
+    """
+    reservation = await engine.get_collection(Reservation).find_one(
+        {"property_id": property_id, "date_start": {"$lt": date_end}},
+        {"date_start": 1, "date_end": 1},
+        sort=[("date_start", DESCENDING)],
+    )
+    if reservation and reservation["date_end"] > date_start:
+        return reservation
+    return None
+
+
+async def get_occupied_days(
+    engine: AIOEngine, property_id: str, first_day: date, last_day: date
+) -> List[bool]:
+    """Occupancy of each day in [first_day, last_day), one bitmap per year"""
+    ranges = split_days_by_year(first_day, last_day)
+    bitmaps = {}
+    async for document in engine.database[AVAILABILITY_COLLECTION].find(
+        {"_id": {"$in": [f"{property_id}:{year}" for year in ranges]}}
+    ):
+        bitmaps[document["year"]] = document["bits"]
+    occupied = []
+    for year, (start, end) in ranges.items():
+        if year in bitmaps:
+            occupied.extend(get_day_bits(bitmaps[year], start, end))
+        else:
+            occupied.extend([False] * (end - start))
+    return occupied
+
+
+async def get_property_with_reservations(
+    engine: AIOEngine, slug: str, limit: int
+) -> Optional[Tuple[Property, List[ReservationInResponse]]]:
+    """Get property by slug with its upcoming reservations in one aggregation.
+
+    Reservations not yet ended are returned by start date, so the first
+    ``limit`` are the next stays rather than the oldest ones.
+    """
+    pipeline = [
+        {"$match": {"slug": slug}},
+        {"$limit": 1},
+        # reservations reference the property by its id as a string
+        {"$addFields": {"_property_id": {"$toString": "$_id"}}},
+        {
+            "$lookup": {
+                "from": Reservation.__collection__,
+                "localField": "_property_id",
+                "foreignField": "property_id",
+                "pipeline": [
+                    {"$match": {"date_end": {"$gte": datetime.utcnow()}}},
+                    {"$sort": {"date_start": 1}},
+                    {"$limit": limit},
+                ],
+                "as": "reservations",
+            }
+        },
+    ]
+    cursor = engine.get_collection(Property).aggregate(pipeline)
+    documents = await cursor.to_list(length=1)
+    if not documents:
+        return None
+    document = documents[0]
+    document.pop("_property_id")
+    reservations = [
+        ReservationInResponse(reservation_id=str(reservation["_id"]), **reservation)
+        for reservation in document.pop("reservations")
+    ]
+    return Property.parse_doc(document), reservations
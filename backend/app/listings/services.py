@@ -1,21 +1,105 @@
-from typing import Any, Optional
-from odmantic import AIOEngine
+import uuid
+import asyncio
+import datetime
+from contextlib import asynccontextmanager
+from typing import (
+    Any,
+    Dict,
+    List,
+    Tuple,
+    Optional,
+    Callable,
+    Awaitable,
+    AsyncIterator,
+)
+from odmantic import AIOEngine, ObjectId
+from pymongo import ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import random
 import string
-from app.auth.models import UserBase
+from app.auth.models import UserBase, UserRole
 from fastapi import HTTPException
 from http import HTTPStatus
 
-from app.listings.models import Property, PropertyInCreate
+from app.listings.models import (
+    ImportStatus,
+    Property,
+    Reservation,
+    PropertyInCreate,
+    ReservationInCreate,
+    PropertyImportResult,
+)
 from slugify import slugify
 
-from app.listings.selectors import get_property_by_slug
+from app.core.config import settings
+from app.listings.cache import property_cache, invalidate_listings
+from app.listings.selectors import AVAILABILITY_COLLECTION, get_overlapping_reservation
+from app.listings.utils import (
+    RESERVED_SLUGS,
+    YEAR_BITMAP_BYTES,
+    set_day_bits,
+    reservation_days,
+    split_days_by_year,
+)
+
+# next numeric suffix per base slug, {"_id": base_slug, "seq": n}
+SLUG_COUNTER_COLLECTION = "slug_counter"
+
+# one document per property being booked, {"_id": property_id, "owner": ...}
+BOOKING_LOCK_COLLECTION = "booking_lock"
 
 
 def random_string_generator(size=10, chars=string.ascii_lowercase + string.digits):
     return "".join(random.choice(chars) for _ in range(size))
 
 
+def _is_slug_conflict(error: Dict[str, Any]) -> bool:
+    key_pattern = error.get("keyPattern")
+    if key_pattern:
+        return "slug" in key_pattern
+    return "slug" in error.get("errmsg", "")
+
+
+async def next_slug_suffix(engine: AIOEngine, base_slug: str) -> int:
+    """Reserve the next numeric suffix for a base slug, starting at 2"""
+    counter = await engine.database[SLUG_COUNTER_COLLECTION].find_one_and_update(
+        {"_id": base_slug},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return counter["seq"] + 1
+
+
+async def insert_with_unique_slug(engine: AIOEngine, db_property: Property) -> Property:
+    """Insert a property, allocating a free slug from its title.
+
+    The unique slug index arbitrates races: the plain slug is tried first,
+    then suffixes from a shared counter, then a random suffix.
+    """
+    collection = engine.get_collection(Property)
+    base_slug = slugify(db_property.title) or "property"
+    slug = base_slug if base_slug not in RESERVED_SLUGS else ""
+    for _ in range(settings.SLUG_MAX_ATTEMPTS):
+        if not slug:
+            slug = "{slug}-{suffix}".format(
+                slug=base_slug, suffix=await next_slug_suffix(engine, base_slug)
+            )
+        db_property.slug = slug
+        try:
+            await collection.insert_one(db_property.doc())
+            return db_property
+        except DuplicateKeyError as exc:
+            if not _is_slug_conflict(exc.details or {}):
+                raise
+            slug = ""
+    db_property.slug = "{slug}-{randstr}".format(
+        slug=base_slug, randstr=random_string_generator()
+    )
+    await collection.insert_one(db_property.doc())
+    return db_property
+
+
 async def check_user_permission(
     engine: AIOEngine, user: UserBase, slug: str = ""
 ) -> Any:
@@ -27,16 +111,278 @@ async def check_user_permission(
         )
 
 
+async def check_export_permission(user: UserBase) -> Any:
+    """Only staff can export the whole catalogue"""
+    if not user.is_superuser and user.role != UserRole.role_staff:
+        raise HTTPException(
+            status_code=HTTPStatus.FORBIDDEN,
+            detail="You have no permission for exporting properties",
+        )
+
+
+async def import_properties(
+    engine: AIOEngine, items: List[Tuple[int, PropertyInCreate]], user: UserBase
+) -> List[PropertyImportResult]:
+    """Insert a batch of properties with one slug query and one insert_many"""
+    collection = engine.get_collection(Property)
+    base_slugs = [slugify(property.title) for _, property in items]
+    taken = set(RESERVED_SLUGS)
+    async for document in collection.find(
+        {"slug": {"$in": list(set(base_slugs))}}, {"slug": 1, "_id": 0}
+    ):
+        taken.add(document["slug"])
+
+    db_properties = []
+    for (_, property), slug in zip(items, base_slugs):
+        if slug in taken:
+            slug = "{slug}-{randstr}".format(
+                slug=slug, randstr=random_string_generator()
+            )
+        taken.add(slug)
+        db_properties.append(Property(**property.dict(), owner=user, slug=slug))
+
+    errors = {}
+    try:
+        await collection.insert_many(
+            [db_property.doc() for db_property in db_properties], ordered=False
+        )
+    except BulkWriteError as exc:
+        for error in exc.details["writeErrors"]:
+            position = error["index"]
+            if not _is_slug_conflict(error):
+                errors[position] = error["errmsg"]
+                continue
+            # slug taken by a concurrent write since the $in query
+            try:
+                await insert_with_unique_slug(engine, db_properties[position])
+            except DuplicateKeyError as retry_exc:
+                errors[position] = str(retry_exc)
+    invalidate_listings()
+
+    results = []
+    for position, ((index, _), db_property) in enumerate(zip(items, db_properties)):
+        if position in errors:
+            result = PropertyImportResult(
+                index=index, status=ImportStatus.status_failed, error=errors[position]
+            )
+        else:
+            result = PropertyImportResult(
+                index=index, status=ImportStatus.status_created, slug=db_property.slug
+            )
+        results.append(result)
+    return results
+
+
+def _booking_lock_busy() -> HTTPException:
+    return HTTPException(
+        status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+        detail="Property is being booked, try again",
+        headers={"Retry-After": "1"},
+    )
+
+
+@asynccontextmanager
+async def property_booking_lock(
+    engine: AIOEngine, property_id: str
+) -> AsyncIterator[Callable[[], Awaitable[None]]]:
+    """Hold the booking lock of a property, the unique _id makes it exclusive.
+
+    The lock expires so a dead holder cannot block a property forever, which
+    means a slow holder can lose it. Await the yielded ``confirm`` right before
+    writing: it renews the lock, or raises if another request took it over.
+    A busy or lost lock answers 503 with Retry-After, 409 is kept for dates
+    that are really taken.
+    """
+    collection = engine.database[BOOKING_LOCK_COLLECTION]
+    owner = uuid.uuid4().hex
+    for _ in range(settings.BOOKING_LOCK_ATTEMPTS):
+        now = datetime.datetime.utcnow()
+        expired_at = now + datetime.timedelta(
+            seconds=settings.BOOKING_LOCK_TIMEOUT_SECONDS
+        )
+        try:
+            await collection.insert_one(
+                {"_id": property_id, "owner": owner, "expired_at": expired_at}
+            )
+            break
+        except DuplicateKeyError:
+            # take over a lock whose holder died without releasing it
+            stolen = await collection.find_one_and_update(
+                {"_id": property_id, "expired_at": {"$lt": now}},
+                {"$set": {"owner": owner, "expired_at": expired_at}},
+            )
+            if stolen:
+                break
+        await asyncio.sleep(settings.BOOKING_LOCK_RETRY_DELAY)
+    else:
+        raise _booking_lock_busy()
+
+    async def confirm() -> None:
+        expired_at = datetime.datetime.utcnow() + datetime.timedelta(
+            seconds=settings.BOOKING_LOCK_TIMEOUT_SECONDS
+        )
+        renewed = await collection.update_one(
+            {"_id": property_id, "owner": owner}, {"$set": {"expired_at": expired_at}}
+        )
+        if not renewed.matched_count:
+            raise _booking_lock_busy()
+
+    try:
+        yield confirm
+    finally:
+        await collection.delete_one({"_id": property_id, "owner": owner})
+
+
+def _bitmap_requests(
+    property_id: str, bitmaps: Dict[int, bytearray]
+) -> List[ReplaceOne]:
+    return [
+        ReplaceOne(
+            {"_id": f"{property_id}:{year}"},
+            {"property_id": property_id, "year": year, "bits": bytes(bitmap)},
+            upsert=True,
+        )
+        for year, bitmap in bitmaps.items()
+    ]
+
+
+async def mark_reservation_days(
+    engine: AIOEngine,
+    property_id: str,
+    date_start: datetime.datetime,
+    date_end: datetime.datetime,
+) -> None:
+    """Mark the days of a new reservation, the caller holds the booking lock"""
+    ranges = split_days_by_year(*reservation_days(date_start, date_end))
+    collection = engine.database[AVAILABILITY_COLLECTION]
+    bitmaps = {year: bytearray(YEAR_BITMAP_BYTES) for year in ranges}
+    async for document in collection.find(
+        {"_id": {"$in": [f"{property_id}:{year}" for year in ranges]}}
+    ):
+        bitmaps[document["year"]] = bytearray(document["bits"])
+    for year, (start, end) in ranges.items():
+        set_day_bits(bitmaps[year], start, end, True)
+    await collection.bulk_write(_bitmap_requests(property_id, bitmaps))
+
+
+async def rebuild_reservation_days(
+    engine: AIOEngine,
+    property_id: str,
+    date_start: datetime.datetime,
+    date_end: datetime.datetime,
+) -> None:
+    """Recompute the days of a removed reservation from the remaining ones.
+
+    Reservations are checked for overlap to the second but occupy whole days,
+    so a day can be shared with another reservation and must stay marked.
+    The caller holds the booking lock.
+    """
+    first_day, last_day = reservation_days(date_start, date_end)
+    ranges = split_days_by_year(first_day, last_day)
+    collection = engine.database[AVAILABILITY_COLLECTION]
+    bitmaps = {year: bytearray(YEAR_BITMAP_BYTES) for year in ranges}
+    async for document in collection.find(
+        {"_id": {"$in": [f"{property_id}:{year}" for year in ranges]}}
+    ):
+        bitmaps[document["year"]] = bytearray(document["bits"])
+    for year, (start, end) in ranges.items():
+        set_day_bits(bitmaps[year], start, end, False)
+    # reservations still holding days of the range
+    async for reservation in engine.get_collection(Reservation).find(
+        {
+            "property_id": property_id,
+            "date_start": {"$lt": datetime.datetime.combine(last_day, datetime.time())},
+            "date_end": {"$gte": datetime.datetime.combine(first_day, datetime.time())},
+        },
+        {"date_start": 1, "date_end": 1},
+    ):
+        days = reservation_days(reservation["date_start"], reservation["date_end"])
+        start_day, end_day = max(days[0], first_day), min(days[1], last_day)
+        for year, (start, end) in split_days_by_year(start_day, end_day).items():
+            set_day_bits(bitmaps[year], start, end, True)
+    await collection.bulk_write(_bitmap_requests(property_id, bitmaps))
+
+
+async def rebuild_property_availability(engine: AIOEngine, property_id: str) -> int:
+    """Rebuild every occupancy bitmap of a property from its reservations"""
+    bitmaps: Dict[int, bytearray] = {}
+    async for reservation in engine.get_collection(Reservation).find(
+        {"property_id": property_id}, {"date_start": 1, "date_end": 1}
+    ):
+        days = reservation_days(reservation["date_start"], reservation["date_end"])
+        for year, (start, end) in split_days_by_year(*days).items():
+            bitmap = bitmaps.setdefault(year, bytearray(YEAR_BITMAP_BYTES))
+            set_day_bits(bitmap, start, end, True)
+    collection = engine.database[AVAILABILITY_COLLECTION]
+    await collection.delete_many(
+        {"property_id": property_id, "year": {"$nin": list(bitmaps)}}
+    )
+    if bitmaps:
+        await collection.bulk_write(_bitmap_requests(property_id, bitmaps))
+    return len(bitmaps)
+
+
+async def create_reservation(
+    engine: AIOEngine, property: Property, data: ReservationInCreate, user: UserBase
+) -> Reservation:
+    """Book a property if the dates are free"""
+    property_id = str(property.id)
+    async with property_booking_lock(engine, property_id) as confirm_lock:
+        overlapping = await get_overlapping_reservation(
+            engine, property_id, data.date_start, data.date_end
+        )
+        if overlapping:
+            raise HTTPException(
+                status_code=HTTPStatus.CONFLICT,
+                detail="The property is already booked for these dates",
+            )
+        reservation = Reservation(
+            **data.dict(), property_id=property_id, username=user.username
+        )
+        await confirm_lock()
+        await engine.get_collection(Reservation).insert_one(reservation.doc())
+        await mark_reservation_days(engine, property_id, data.date_start, data.date_end)
+    property_cache.pop(property.slug)
+    return reservation
+
+
+async def cancel_reservation(
+    engine: AIOEngine, property: Property, reservation_id: str, user: UserBase
+) -> None:
+    """Cancel a reservation, by its guest, the property owner or a superuser"""
+    if not ObjectId.is_valid(reservation_id):
+        raise HTTPException(HTTPStatus.NOT_FOUND, "Reservation not found")
+    property_id = str(property.id)
+    async with property_booking_lock(engine, property_id) as confirm_lock:
+        reservation = await engine.find_one(
+            Reservation,
+            Reservation.id == ObjectId(reservation_id),
+            Reservation.property_id == property_id,
+        )
+        if not reservation:
+            raise HTTPException(HTTPStatus.NOT_FOUND, "Reservation not found")
+        if (
+            reservation.username != user.username
+            and property.owner.username != user.username
+            and not user.is_superuser
+        ):
+            raise HTTPException(
+                status_code=HTTPStatus.FORBIDDEN,
+                detail="You have no permission for cancelling this reservation",
+            )
+        await confirm_lock()
+        await engine.delete(reservation)
+        await rebuild_reservation_days(
+            engine, property_id, reservation.date_start, reservation.date_end
+        )
+    property_cache.pop(property.slug)
+
+
 async def create_property(
     engine: AIOEngine, property: PropertyInCreate, user: UserBase
 ) -> Optional[Property]:
     """Create new Post"""
-    slug = slugify(property.title)
-    slug_exist = await get_property_by_slug(engine, slug)
-    if slug_exist:
-        slug = "{slug}-{randstr}".format(slug=slug, randstr=random_string_generator())
-
-    db_property = Property(**property.dict(), owner=user, slug=slug)
-    await engine.save(db_property)
-    created_property = await get_property_by_slug(engine, slug)
-    return created_property
+    db_property = Property(**property.dict(), owner=user, slug=slugify(property.title))
+    await insert_with_unique_slug(engine, db_property)
+    invalidate_listings(db_property.slug)
+    return db_property
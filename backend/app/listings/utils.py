@@ -0,0 +1,129 @@
+import io
+import csv
+import json
+import base64
+import binascii
+from typing import Any, Dict, List, Tuple, AsyncIterator
+from datetime import date, datetime, timedelta
+
+from odmantic import ObjectId
+from bson.errors import InvalidId
+
+# slugs that would shadow the static routes of the listings router
+RESERVED_SLUGS = {"export", "facets", "import", "search"}
+
+# one bit per day of a calendar year, day 0 is January 1st
+YEAR_BITMAP_BYTES = 46
+
+# exported columns, dotted paths into the property document
+EXPORT_FIELDS = [
+    "_id",
+    "slug",
+    "title",
+    "description",
+    "price",
+    "property_type",
+    "is_active",
+    "address.street",
+    "address.city",
+    "feature_image",
+    "owner.username",
+    "created_at",
+    "updated_at",
+]
+
+
+def encode_feed_cursor(created_at: datetime, id: ObjectId) -> str:
+    """Encode the (created_at, _id) keyset position as an opaque cursor"""
+    raw = json.dumps([created_at.isoformat(), str(id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def document_created_at(document: Dict[str, Any]) -> datetime:
+    """created_at of a raw property document, its _id time if stored before it"""
+    created_at = document.get("created_at")
+    if created_at is None:
+        created_at = document["_id"].generation_time.replace(tzinfo=None)
+    return created_at
+
+
+def decode_feed_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """Decode an opaque cursor, raise ValueError if it is malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), ObjectId(id)
+    except (binascii.Error, InvalidId, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+def _export_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+
+def flatten_export_doc(doc: Dict[str, Any]) -> List[Any]:
+    """Pick EXPORT_FIELDS out of a property document, in column order"""
+    row = []
+    for field in EXPORT_FIELDS:
+        value = doc
+        for key in field.split("."):
+            value = value.get(key) if isinstance(value, dict) else None
+        row.append(_export_value(value))
+    return row
+
+
+def to_ndjson_line(row: List[Any]) -> str:
+    return json.dumps(dict(zip(EXPORT_FIELDS, row)), default=str) + "\n"
+
+
+def to_csv_line(row: List[Any]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(row)
+    return buffer.getvalue()
+
+
+def reservation_days(date_start: datetime, date_end: datetime) -> Tuple[date, date]:
+    """Days [first, last) a reservation occupies, the checkout day stays free"""
+    first_day = date_start.date()
+    return first_day, max(date_end.date(), first_day + timedelta(days=1))
+
+
+def split_days_by_year(first_day: date, last_day: date) -> Dict[int, Tuple[int, int]]:
+    """Map each year of [first_day, last_day) to its [start, end) day offsets"""
+    ranges = {}
+    for year in range(first_day.year, last_day.year + 1):
+        year_start = date(year, 1, 1)
+        start = max(first_day, year_start)
+        end = min(last_day, date(year + 1, 1, 1))
+        if start < end:
+            ranges[year] = ((start - year_start).days, (end - year_start).days)
+    return ranges
+
+
+def set_day_bits(bitmap: bytearray, start: int, end: int, value: bool) -> None:
+    for day in range(start, end):
+        if value:
+            bitmap[day >> 3] |= 1 << (day & 7)
+        else:
+            bitmap[day >> 3] &= ~(1 << (day & 7)) & 0xFF
+
+
+def get_day_bits(bitmap: bytes, start: int, end: int) -> List[bool]:
+    return [bool(bitmap[day >> 3] & (1 << (day & 7))) for day in range(start, end)]
+
+
+async def iter_ndjson_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Split a streamed request body into its non-empty lines"""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if pending.strip():
+        yield pending
@@ -1,12 +1,48 @@
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 
+from app.auth.utils import shutdown_hash_executor
+from app.auth.revocation import revocation_list
 from app.auth.router import router as auth_router
+from app.core.mail import OutboxSender
 from app.core.config import settings
+from app.core.metrics import MetricsMiddleware, metrics, mark_worker_dead
+from app.core.router import router as core_router
+from app.core.migrations import apply_indexes
+from app.core.services import ORJSONResponse, create_engine, create_mongo_client
 from app.listings.router import router as listings_router
 
-app = FastAPI(title=settings.PROJECT_NAME)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    client = create_mongo_client()
+    app.state.mongo_client = client
+    app.state.engine = create_engine(client)
+    if settings.MONGO_APPLY_INDEXES:
+        await apply_indexes(app.state.engine)
+    await revocation_list.sync(app.state.engine)
+    revocation_list.start(app.state.engine)
+    outbox_sender = OutboxSender(app.state.engine)
+    if settings.SMTP_HOST:
+        outbox_sender.start()
+    try:
+        yield
+    finally:
+        await outbox_sender.stop()
+        await revocation_list.stop()
+        shutdown_hash_executor()
+        client.close()
+        mark_worker_dead()
+
+
+app = FastAPI(
+    title=settings.PROJECT_NAME,
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 
 if settings.BACKEND_CORS_ORIGINS:
@@ -19,9 +55,17 @@ if settings.BACKEND_CORS_ORIGINS:
     )
 
 
+if settings.METRICS_ENABLED:
+    # added last, so it also times the CORS middleware
+    app.add_middleware(MetricsMiddleware)
+    app.add_route("/metrics", metrics, include_in_schema=False)
+
+
 app.include_router(auth_router, prefix=settings.API_STR, tags=["Authentication"])
 app.include_router(listings_router, prefix=settings.API_STR, tags=["Listings"])
+app.include_router(core_router, prefix=settings.API_STR, tags=["Health"])
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+    # development server, serve with ``main.py`` in production
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
@@ -1,5 +1,102 @@
+"""Serve the API with uvicorn, ``uv run main.py --help`` lists the options.
+
+Every worker is a separate process that imports the app and opens its own
+Mongo connection pool on startup, so no connection is shared across a fork.
+Anything that must happen once, or be the same in every worker, is done
+here before the workers start.
+"""
+
+import os
+import sys
+import asyncio
+import argparse
+import tempfile
+
+import uvicorn
+
+from app.core.config import settings
+from app.core.services import create_engine, create_mongo_client
+from app.core.migrations import apply_indexes
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Serve the API")
+    parser.add_argument("--host", default=settings.SERVER_BIND_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.SERVER_WORKERS or os.cpu_count() or 1,
+        help="worker processes, defaults to the CPU count",
+    )
+    parser.add_argument(
+        "--keep-alive",
+        type=int,
+        default=settings.SERVER_KEEP_ALIVE_SECONDS,
+        help="seconds an idle keep-alive connection stays open",
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        default=settings.SERVER_BACKLOG,
+        help="pending connections queued by the listening socket",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=int,
+        default=settings.SERVER_GRACEFUL_SHUTDOWN_SECONDS,
+        help="seconds in-flight requests get to finish on shutdown",
+    )
+    parser.add_argument(
+        "--reload", action="store_true", help="single worker, reload on changes"
+    )
+    return parser.parse_args()
+
+
+async def apply_migrations() -> None:
+    client = create_mongo_client()
+    try:
+        await apply_indexes(create_engine(client))
+    finally:
+        client.close()
+
+
 def main():
-    print("Hello from backend!")
+    args = parse_args()
+    workers = 1 if args.reload else max(args.workers, 1)
+    if "SECRET_KEY" not in os.environ:
+        # workers re-read the settings, a key generated in each of them would
+        # reject tokens signed by the others
+        os.environ["SECRET_KEY"] = settings.SECRET_KEY
+        print(
+            "SECRET_KEY is not set, tokens are signed with a generated key and "
+            "will not survive a restart",
+            file=sys.stderr,
+        )
+    if settings.MONGO_APPLY_INDEXES:
+        # once, concurrent workers would race dropping a changed index
+        asyncio.run(apply_migrations())
+        settings.MONGO_APPLY_INDEXES = False
+        os.environ["MONGO_APPLY_INDEXES"] = "false"
+    if workers > 1 and settings.METRICS_ENABLED:
+        # must be set before the workers import prometheus_client
+        os.environ.setdefault(
+            "PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="prometheus-")
+        )
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        reload=args.reload,
+        loop="uvloop",
+        http="httptools",
+        timeout_keep_alive=args.keep_alive,
+        backlog=args.backlog,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=True,
+        forwarded_allow_ips=settings.FORWARDED_ALLOW_IPS,
+    )
 
 
 if __name__ == "__main__":
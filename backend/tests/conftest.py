@@ -0,0 +1,201 @@
+"""Fixtures of the test and benchmark suite.
+
+The app runs in process, on a real mongod given by ``MONGODB_TEST_URL``
+(default ``mongodb://localhost:27017``), in a throwaway database dropped at
+the end of the session. Tests that need Mongo are skipped when it is not
+reachable. Benchmark results are written as JSON to ``BENCH_RESULTS_DIR``
+(default ``bench-results/``), one file per run, so runs can be compared.
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import datetime
+import platform
+import statistics
+from typing import Any, Dict, List, Callable, Awaitable
+
+MONGODB_TEST_URL = os.environ.get("MONGODB_TEST_URL", "mongodb://localhost:27017")
+
+# settings are read on import of the app, override them first
+os.environ["MONGODB_URL"] = MONGODB_TEST_URL
+os.environ["database_name"] = "test_" + uuid.uuid4().hex[:8]
+os.environ["SECRET_KEY"] = "test-secret-key-of-at-least-32-bytes"
+os.environ["SMTP_HOST"] = ""
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["MONGO_COMMANDS_HEADER"] = "true"
+
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+from pymongo import MongoClient  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+from app.main import app  # noqa: E402
+from app.auth.utils import get_password_hash  # noqa: E402
+from app.auth.models import User  # noqa: E402
+from app.core.config import settings  # noqa: E402
+from tests.utils import (  # noqa: E402
+    TEST_PASSWORD,
+    summarize,
+    clear_caches,
+    cookie_header,
+    mongo_commands,
+)
+
+BENCH_RESULTS_DIR = os.environ.get("BENCH_RESULTS_DIR", "bench-results")
+BENCH_REQUESTS = int(os.environ.get("BENCH_REQUESTS", "200"))
+BENCH_CONCURRENCY = int(os.environ.get("BENCH_CONCURRENCY", "10"))
+
+
+@pytest.fixture(scope="session")
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+def mongo_url() -> str:
+    client = MongoClient(MONGODB_TEST_URL, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+    except PyMongoError as exc:
+        pytest.skip(f"mongod is not reachable at {MONGODB_TEST_URL}: {exc}")
+    finally:
+        client.close()
+    return MONGODB_TEST_URL
+
+
+@pytest.fixture(scope="session")
+async def app_lifespan(mongo_url):
+    """Start the app once, as a worker would, and drop its database after"""
+    async with app.router.lifespan_context(app):
+        yield app
+        await app.state.mongo_client.drop_database(settings.database_name)
+
+
+@pytest.fixture
+async def engine(app_lifespan):
+    """Engine of the app, on empty collections and cold caches"""
+    engine = app_lifespan.state.engine
+    for name in await engine.database.list_collection_names():
+        await engine.database[name].delete_many({})
+    clear_caches()
+    yield engine
+
+
+@pytest.fixture
+async def client(engine):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+def make_user(engine) -> Callable[..., Awaitable[User]]:
+    async def make_user(email: str = "", **fields: Any) -> User:
+        email = email or f"user-{uuid.uuid4().hex[:8]}@example.com"
+        user = User(
+            first_name="Test",
+            last_name="User",
+            email=email,
+            username=email.split("@")[0],
+            password=get_password_hash(TEST_PASSWORD),
+            is_verified=True,
+            **fields,
+        )
+        await engine.save(user)
+        return user
+
+    return make_user
+
+
+@pytest.fixture
+async def auth_headers(client, make_user) -> Dict[str, str]:
+    """Cookie header of a logged in, verified user"""
+    user = await make_user()
+    response = await client.post(
+        f"{settings.API_STR}/auth/login",
+        json={"email": user.email, "password": TEST_PASSWORD},
+    )
+    assert response.status_code == 200, response.text
+    return cookie_header(response)
+
+
+class BenchResults:
+    """Collect named benchmark results, written as JSON at the end"""
+
+    def __init__(self) -> None:
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, name: str, **result: Any) -> Dict[str, Any]:
+        self.results[name] = result
+        return result
+
+    async def run(
+        self,
+        name: str,
+        request: Callable[[int], Awaitable[httpx.Response]],
+        requests: int = BENCH_REQUESTS,
+        concurrency: int = BENCH_CONCURRENCY,
+        expected_status: int = 200,
+        warmup: int = 1,
+        **extra: Any,
+    ) -> Dict[str, Any]:
+        """Send ``requests`` requests, ``concurrency`` at a time, after warming up.
+
+        ``extra`` is recorded with the result, e.g. the size of the dataset.
+        """
+        for index in range(warmup):
+            response = await request(requests + index)
+            assert response.status_code == expected_status, response.text
+        latencies: List[float] = []
+        commands: List[int] = []
+        counter = iter(range(requests))
+
+        async def worker() -> None:
+            for index in counter:
+                started_at = time.perf_counter()
+                response = await request(index)
+                latencies.append(time.perf_counter() - started_at)
+                assert response.status_code == expected_status, response.text
+                commands.append(mongo_commands(response))
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        result = summarize(latencies, time.perf_counter() - started_at)
+        result.update(
+            concurrency=concurrency,
+            mongo_commands_max=max(commands),
+            mongo_commands_mean=statistics.fmean(commands),
+            **extra,
+        )
+        return self.record(name, **result)
+
+    def write(self) -> None:
+        if not self.results:
+            return
+        os.makedirs(BENCH_RESULTS_DIR, exist_ok=True)
+        now = datetime.datetime.utcnow()
+        path = os.path.join(
+            BENCH_RESULTS_DIR, f"bench-{now.strftime('%Y%m%dT%H%M%S')}.json"
+        )
+        with open(path, "w") as output:
+            json.dump(
+                {
+                    "created_at": now.isoformat(),
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "cpu_count": os.cpu_count(),
+                    "results": self.results,
+                },
+                output,
+                indent=2,
+            )
+
+
+@pytest.fixture(scope="session")
+def bench():
+    results = BenchResults()
+    yield results
+    results.write()
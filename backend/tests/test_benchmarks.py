@@ -0,0 +1,334 @@
+"""Latency and throughput of the main endpoints.
+
+Run alone with ``pytest -m benchmark``. Results are written to
+``BENCH_RESULTS_DIR``. A run fails when a p95 latency goes over its ceiling
+(``BENCH_MAX_P95_MS``, bcrypt bound routes ``BENCH_MAX_LOGIN_P95_MS``) or a
+route sends more Mongo commands than its budget.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import signal
+import subprocess
+import contextlib
+from typing import AsyncIterator
+
+import httpx
+import pytest
+
+from app.auth import utils as auth_utils
+from app.core.config import settings
+from app.core.security import (
+    _decode_token,
+    decode_access_token,
+    create_access_token,
+)
+from tests.utils import (
+    TEST_PASSWORD,
+    loop_lag,
+    free_port,
+    summarize,
+    clear_caches,
+    seed_properties,
+    property_payload,
+)
+
+pytestmark = [pytest.mark.anyio, pytest.mark.benchmark]
+
+API = settings.API_STR
+MAX_P95_MS = float(os.environ.get("BENCH_MAX_P95_MS", "250"))
+MAX_LOGIN_P95_MS = float(os.environ.get("BENCH_MAX_LOGIN_P95_MS", "2000"))
+MAX_LOOP_LAG_P99_MS = float(os.environ.get("BENCH_MAX_LOOP_LAG_P99_MS", "50"))
+MAX_SEARCH_P95_MS = float(os.environ.get("BENCH_MAX_SEARCH_P95_MS", "1000"))
+FEED_LISTINGS = 1000
+SEARCH_LISTINGS = int(os.environ.get("BENCH_SEARCH_LISTINGS", "100000"))
+IMPORT_LISTINGS = int(os.environ.get("BENCH_IMPORT_LISTINGS", "5000"))
+TOKEN_DECODES = int(os.environ.get("BENCH_TOKEN_DECODES", "20000"))
+SERVER_WORKERS = int(os.environ.get("BENCH_SERVER_WORKERS", os.cpu_count() or 2))
+BENCH_SERVER_CONNECTIONS = int(os.environ.get("BENCH_SERVER_CONNECTIONS", "32"))
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def check(result, max_p95_ms: float, budget_key: str) -> None:
+    assert result["p95_ms"] <= max_p95_ms, result
+    assert result["mongo_commands_max"] <= settings.MONGO_COMMAND_BUDGETS[budget_key]
+
+
+async def test_login(client, make_user, bench):
+    user = await make_user()
+    result = await bench.run(
+        "auth_login",
+        lambda _: client.post(
+            f"{API}/auth/login", json={"email": user.email, "password": TEST_PASSWORD}
+        ),
+        requests=50,
+        # one login per hash worker, more would only queue for bcrypt
+        concurrency=settings.PASSWORD_HASH_WORKERS,
+    )
+    check(result, MAX_LOGIN_P95_MS, "POST /auth/login")
+
+
+@pytest.mark.parametrize("hashing", ["executor", "inline"])
+async def test_login_storm_loop_lag(client, make_user, bench, monkeypatch, hashing):
+    """Event loop lag while logins queue for bcrypt.
+
+    ``inline`` verifies passwords on the event loop as before the hash pool,
+    the baseline the ``executor`` run is compared with.
+    """
+    user = await make_user()
+    if hashing == "inline":
+
+        async def run_inline(func, *args):
+            return func(*args)
+
+        monkeypatch.setattr(auth_utils, "_run_hash", run_inline)
+
+    name = f"auth_login_storm_{hashing}"
+    async with loop_lag() as lags:
+        result = await bench.run(
+            name,
+            lambda _: client.post(
+                f"{API}/auth/login",
+                json={"email": user.email, "password": TEST_PASSWORD},
+            ),
+            requests=50,
+            # more logins than hash workers, the rest wait in the queue
+            concurrency=settings.PASSWORD_HASH_WORKERS * 4,
+        )
+    lag = summarize(lags, 0)
+    bench.record(
+        name,
+        **result,
+        loop_lag_p50_ms=lag["p50_ms"],
+        loop_lag_p99_ms=lag["p99_ms"],
+        loop_lag_max_ms=lag["max_ms"],
+    )
+    if hashing == "executor":
+        assert lag["p99_ms"] <= MAX_LOOP_LAG_P99_MS, lag
+
+
+def test_decode_access_token(bench):
+    """CPU cost of the auth dependency per request, cached vs a full JWT decode.
+
+    Needs no database.
+    """
+    tokens = [create_access_token(f"user-{index}") for index in range(100)]
+
+    def per_call_us(decode) -> float:
+        for token in tokens:
+            decode(token)
+        started_at = time.perf_counter()
+        for index in range(TOKEN_DECODES):
+            decode(tokens[index % len(tokens)])
+        return (time.perf_counter() - started_at) * 1e6 / TOKEN_DECODES
+
+    uncached_us = per_call_us(_decode_token)
+    cached_us = per_call_us(decode_access_token)
+    result = bench.record(
+        "auth_decode_access_token",
+        decodes=TOKEN_DECODES,
+        cached_us=cached_us,
+        uncached_us=uncached_us,
+        speedup=uncached_us / cached_us,
+    )
+    assert cached_us < uncached_us, result
+
+
+async def test_profile(client, auth_headers, bench):
+    result = await bench.run(
+        "auth_profile",
+        lambda _: client.get(f"{API}/auth/profile", headers=auth_headers),
+    )
+    check(result, MAX_P95_MS, "GET /auth/profile")
+
+
+@pytest.mark.parametrize("cached", [True, False], ids=["cached", "uncached"])
+async def test_feed(client, engine, make_user, bench, cached):
+    await seed_properties(engine, await make_user(), FEED_LISTINGS)
+
+    async def request(_):
+        if not cached:
+            clear_caches()
+        return await client.get(f"{API}/feed/", params={"limit": 20})
+
+    result = await bench.run(f"feed{'' if cached else '_uncached'}", request)
+    check(result, MAX_P95_MS, "GET /feed/")
+
+
+async def test_feed_views(client, engine, make_user, bench):
+    """CPU time and bytes of an uncached page, full properties vs cards.
+
+    The client runs in the same process, its share of the CPU time is the
+    same for both views.
+    """
+    await seed_properties(engine, await make_user(), FEED_LISTINGS)
+    results = {}
+    for view in ("full", "card"):
+        sizes = []
+
+        async def request(_):
+            clear_caches()
+            response = await client.get(
+                f"{API}/feed/", params={"limit": 20, "view": view}
+            )
+            sizes.append(len(response.content))
+            return response
+
+        cpu_started_at = time.process_time()
+        result = await bench.run(f"feed_view_{view}", request, warmup=0)
+        cpu_time = time.process_time() - cpu_started_at
+        results[view] = bench.record(
+            f"feed_view_{view}",
+            **result,
+            cpu_ms_per_page=cpu_time * 1000 / result["requests"],
+            bytes_per_page=sum(sizes) / len(sizes),
+        )
+        check(result, MAX_P95_MS, "GET /feed/")
+    assert results["card"]["bytes_per_page"] < results["full"]["bytes_per_page"]
+
+
+@pytest.mark.parametrize("cached", [True, False], ids=["cached", "uncached"])
+async def test_feed_property(client, engine, make_user, bench, cached):
+    properties = await seed_properties(engine, await make_user(), FEED_LISTINGS)
+
+    async def request(_):
+        if not cached:
+            clear_caches()
+        slug = random.choice(properties).slug
+        return await client.get(f"{API}/feed/{slug}")
+
+    result = await bench.run(f"feed_property{'' if cached else '_uncached'}", request)
+    check(result, MAX_P95_MS, "GET /feed/{slug}")
+
+
+async def test_new_property(client, auth_headers, bench):
+    result = await bench.run(
+        "feed_new_property",
+        lambda index: client.post(
+            f"{API}/feed/",
+            json={"property": property_payload(f"New listing {index}")},
+            headers=auth_headers,
+        ),
+        expected_status=201,
+    )
+    check(result, MAX_P95_MS, "POST /feed/")
+
+
+async def test_import(client, auth_headers, bench):
+    """Listings per second of one NDJSON import vs one create per request"""
+    single = await bench.run(
+        "feed_create_one_by_one",
+        lambda index: client.post(
+            f"{API}/feed/",
+            json={"property": property_payload(f"Single listing {index}")},
+            headers=auth_headers,
+        ),
+        expected_status=201,
+    )
+    body = "".join(
+        json.dumps(property_payload(f"Imported listing {index}")) + "\n"
+        for index in range(IMPORT_LISTINGS)
+    )
+    started_at = time.perf_counter()
+    response = await client.post(
+        f"{API}/feed/import",
+        content=body,
+        headers={**auth_headers, "Content-Type": "application/x-ndjson"},
+    )
+    elapsed = time.perf_counter() - started_at
+    assert response.status_code == 200, response.text
+    assert response.json()["created_count"] == IMPORT_LISTINGS
+    imported = bench.record(
+        "feed_import",
+        listings=IMPORT_LISTINGS,
+        elapsed_s=elapsed,
+        listings_per_s=IMPORT_LISTINGS / elapsed,
+        one_by_one_listings_per_s=single["throughput_rps"],
+    )
+    assert imported["listings_per_s"] > single["throughput_rps"], imported
+
+
+async def test_search(client, engine, make_user, bench):
+    await seed_properties(engine, await make_user(), SEARCH_LISTINGS)
+
+    async def search(q: str):
+        # cold caches, the count is not reused between requests
+        clear_caches()
+        params = {"q": q, "limit": settings.SEARCH_MAX_LIMIT}
+        return await client.get(f"{API}/feed/search", params=params)
+
+    # a listing number matches a single listing
+    result = await bench.run(
+        "feed_search_selective",
+        lambda _: search(str(random.randrange(SEARCH_LISTINGS))),
+        listings=SEARCH_LISTINGS,
+    )
+    assert result["p95_ms"] <= MAX_P95_MS, result
+    # every description has a garden, the worst case of the relevance sort
+    result = await bench.run(
+        "feed_search_broad", lambda _: search("garden"), listings=SEARCH_LISTINGS
+    )
+    assert result["p95_ms"] <= MAX_SEARCH_P95_MS, result
+
+
+@contextlib.asynccontextmanager
+async def serve(workers: int) -> AsyncIterator[httpx.AsyncClient]:
+    """Run main.py on a free port, on the test database, and connect to it"""
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "main.py", "--workers", str(workers), "--port", str(port)],
+        cwd=BACKEND_DIR,
+        # the indexes are in place, the settings of the suite are inherited
+        env={**os.environ, "MONGO_APPLY_INDEXES": "false"},
+    )
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}",
+            limits=httpx.Limits(max_connections=BENCH_SERVER_CONNECTIONS),
+        ) as client:
+            deadline = time.monotonic() + 30
+            while True:
+                assert server.poll() is None, "main.py exited"
+                try:
+                    await client.get(f"{API}/feed/", params={"limit": 1})
+                    break
+                except httpx.TransportError:
+                    assert time.monotonic() < deadline, "main.py did not start"
+                    await asyncio.sleep(0.2)
+            yield client
+    finally:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+
+async def test_server_workers(engine, make_user, bench):
+    """Throughput of main.py over a real socket, one worker vs several"""
+    await seed_properties(engine, await make_user(), FEED_LISTINGS)
+    throughput = {}
+    for workers in sorted({1, SERVER_WORKERS}):
+        async with serve(workers) as client:
+            result = await bench.run(
+                f"server_workers_{workers}",
+                lambda _: client.get(
+                    f"{API}/feed/", params={"limit": 20, "view": "card"}
+                ),
+                concurrency=BENCH_SERVER_CONNECTIONS,
+                # every worker fills its own cache before the run
+                warmup=workers * 4,
+                workers=workers,
+            )
+        throughput[workers] = result["throughput_rps"]
+    bench.record(
+        "server_workers",
+        cpu_count=os.cpu_count(),
+        throughput_rps=throughput,
+        speedup=throughput[SERVER_WORKERS] / throughput[1],
+    )
@@ -0,0 +1,96 @@
+"""Mongo commands per request, against MONGO_COMMAND_BUDGETS.
+
+Caches are cold in every test, so the counts are the worst case of a route.
+An extra round trip added to one of these routes fails here.
+"""
+
+import pytest
+
+from app.core.config import settings
+from tests.utils import (
+    TEST_PASSWORD,
+    clear_caches,
+    mongo_commands,
+    seed_properties,
+    property_payload,
+)
+
+pytestmark = pytest.mark.anyio
+
+API = settings.API_STR
+
+
+def budget(key: str) -> int:
+    return settings.MONGO_COMMAND_BUDGETS[key]
+
+
+async def test_register(client):
+    response = await client.post(
+        f"{API}/auth/register",
+        json={
+            "user": {
+                "email": "new.user@example.com",
+                "password": TEST_PASSWORD,
+                "password_confirm": TEST_PASSWORD,
+                "first_name": "New",
+                "last_name": "User",
+            }
+        },
+    )
+    assert response.status_code == 201, response.text
+    assert mongo_commands(response) <= budget("POST /auth/register")
+
+
+async def test_login(client, make_user):
+    user = await make_user()
+    response = await client.post(
+        f"{API}/auth/login", json={"email": user.email, "password": TEST_PASSWORD}
+    )
+    assert response.status_code == 200, response.text
+    assert mongo_commands(response) <= budget("POST /auth/login")
+
+
+async def test_profile(client, auth_headers):
+    clear_caches()
+    response = await client.get(f"{API}/auth/profile", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    assert mongo_commands(response) <= budget("GET /auth/profile")
+
+
+@pytest.mark.parametrize("view", ["full", "card"])
+async def test_feed(client, engine, make_user, view):
+    await seed_properties(engine, await make_user(), 45)
+    response = await client.get(f"{API}/feed/", params={"view": view})
+    assert response.status_code == 200, response.text
+    assert mongo_commands(response) <= budget("GET /feed/")
+
+    cursor = response.json()["next_cursor"]
+    response = await client.get(f"{API}/feed/", params={"view": view, "cursor": cursor})
+    assert response.status_code == 200, response.text
+    assert len(response.json()["properties"]) == 20
+    # the count is cached for the filters, the next page is a single find
+    assert mongo_commands(response) <= budget("GET /feed/")
+
+
+async def test_feed_property(client, engine, make_user):
+    properties = await seed_properties(engine, await make_user(), 3)
+    response = await client.get(f"{API}/feed/{properties[1].slug}")
+    assert response.status_code == 200, response.text
+    assert mongo_commands(response) <= budget("GET /feed/{slug}")
+
+
+async def test_new_property(client, auth_headers):
+    clear_caches()
+    response = await client.post(
+        f"{API}/feed/", json={"property": property_payload()}, headers=auth_headers
+    )
+    assert response.status_code == 201, response.text
+    assert mongo_commands(response) <= budget("POST /feed/")
+
+    # the same title again, the slug conflict takes a counter suffix
+    response = await client.post(
+        f"{API}/feed/", json={"property": property_payload()}, headers=auth_headers
+    )
+    assert response.status_code == 201, response.text
+    assert response.json()["slug"] == "sunny-flat-2"
+    assert mongo_commands(response) <= budget("POST /feed/")
@@ -0,0 +1,81 @@
+"""Keyset pages of the feed."""
+
+from typing import List
+
+import pytest
+
+from app.core.config import settings
+from app.core.migrations import apply_indexes
+from app.listings.models import Property
+from tests.utils import clear_caches, seed_properties, property_payload
+
+pytestmark = pytest.mark.anyio
+
+API = settings.API_STR
+
+
+async def walk_feed(client, view: str, limit: int) -> List[str]:
+    """Slugs of every page, following next_cursor"""
+    slugs, params = [], {"view": view, "limit": limit}
+    while True:
+        response = await client.get(f"{API}/feed/", params=params)
+        assert response.status_code == 200, response.text
+        page = response.json()
+        slugs.extend(property["slug"] for property in page["properties"])
+        if not page["next_cursor"]:
+            return slugs
+        params["cursor"] = page["next_cursor"]
+
+
+@pytest.mark.parametrize("view", ["full", "card"])
+async def test_pages_across_legacy_properties(client, engine, make_user, view):
+    properties = await seed_properties(engine, await make_user(), 25)
+    # stored before created_at was persisted, they sort last
+    legacy = [property.id for property in properties[:5]]
+    collection = engine.get_collection(Property)
+    await collection.update_many(
+        {"_id": {"$in": legacy}}, {"$unset": {"created_at": "", "updated_at": ""}}
+    )
+    if view == "card":
+        # the last full page ends on a legacy document, its cursor must not fail
+        await walk_feed(client, view, limit=5)
+
+    applied = await apply_indexes(engine)
+    assert applied[Property.__collection__]["backfilled_created_at"] == 5
+    clear_caches()
+
+    slugs = await walk_feed(client, view, limit=5)
+    assert sorted(slugs) == sorted(property.slug for property in properties)
+    assert await collection.count_documents({"created_at": None}) == 0
+
+
+async def test_price_facets_match_the_price_filter(client, engine, make_user):
+    properties = await seed_properties(engine, await make_user(), 3)
+    collection = engine.get_collection(Property)
+    # a negative price stored before prices were validated
+    for property, price in zip(properties, (-5, 10, 2_000_000)):
+        await collection.update_one({"_id": property.id}, {"$set": {"price": price}})
+
+    response = await client.get(f"{API}/feed/facets")
+    assert response.status_code == 200, response.text
+    buckets = response.json()["price"]
+    assert [(bucket["min_price"], bucket["max_price"]) for bucket in buckets] == [
+        (0, 50_000),
+        (1_000_000, None),
+    ]
+    for bucket in buckets:
+        params = {"min_price": bucket["min_price"]}
+        if bucket["max_price"] is not None:
+            # the filter bounds are inclusive, bucket upper bounds are not
+            params["max_price"] = bucket["max_price"] - 0.01
+        response = await client.get(f"{API}/feed/", params=params)
+        assert response.json()["properties_count"] == bucket["count"] == 1
+
+
+async def test_negative_price_rejected(client, auth_headers):
+    response = await client.post(
+        f"{API}/feed/",
+        json={"property": property_payload(price=-1)},
+        headers=auth_headers,
+    )
+    assert response.status_code == 422, response.text
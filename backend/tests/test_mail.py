@@ -0,0 +1,98 @@
+"""Email outbox delivery against a local aiosmtpd server."""
+
+from typing import List
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from app.core.config import settings
+from app.core.mail import OutboxEmail, OutboxSender, OutboxStatus, enqueue_email
+from tests.utils import free_port
+
+pytestmark = pytest.mark.anyio
+
+
+class Inbox:
+    """aiosmtpd handler keeping the delivered messages, refusing some"""
+
+    def __init__(self) -> None:
+        self.messages: List[bytes] = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("refused"):
+            return "550 mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope.content)
+        return "250 Message accepted for delivery"
+
+
+@pytest.fixture
+def inbox(monkeypatch):
+    inbox = Inbox()
+    controller = Controller(inbox, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    monkeypatch.setattr(settings, "SMTP_HOST", controller.hostname)
+    monkeypatch.setattr(settings, "SMTP_PORT", controller.port)
+    monkeypatch.setattr(settings, "SMTP_USER", None)
+    monkeypatch.setattr(settings, "EMAILS_FROM_EMAIL", "noreply@example.com")
+    yield inbox
+    controller.stop()
+
+
+async def statuses(engine) -> List[OutboxStatus]:
+    return [
+        email.status for email in await engine.find(OutboxEmail, sort=OutboxEmail.id)
+    ]
+
+
+async def test_drain_batches(engine, inbox, monkeypatch):
+    monkeypatch.setattr(settings, "EMAIL_OUTBOX_BATCH_SIZE", 3)
+    for index in range(5):
+        await enqueue_email(engine, f"user{index}@example.com", f"Hello {index}", "<p>")
+    sender = OutboxSender(engine)
+    try:
+        assert await sender.drain_batch() == 3
+        assert await sender.drain_batch() == 2
+        assert await sender.drain_batch() == 0
+    finally:
+        await sender.stop()
+    assert len(inbox.messages) == 5
+    assert await statuses(engine) == [OutboxStatus.status_sent] * 5
+
+
+async def test_failed_send_is_retried(engine, inbox):
+    await enqueue_email(engine, "refused@example.com", "Hello", "<p>")
+    sender = OutboxSender(engine)
+    try:
+        assert await sender.drain_batch() == 1
+    finally:
+        await sender.stop()
+    (email,) = await engine.find(OutboxEmail)
+    assert email.status == OutboxStatus.status_pending
+    assert email.attempts == 1 and email.last_error
+    assert email.next_attempt_at > email.id.generation_time.replace(tzinfo=None)
+
+
+async def test_sent_recorded_when_batch_fails(engine, inbox, monkeypatch):
+    await enqueue_email(engine, "user@example.com", "Hello", "<p>")
+    await enqueue_email(engine, "refused@example.com", "Hello", "<p>")
+
+    async def retry_later(email, exc):
+        raise RuntimeError("database unavailable")
+
+    sender = OutboxSender(engine)
+    monkeypatch.setattr(sender, "_retry_later", retry_later)
+    try:
+        with pytest.raises(RuntimeError):
+            await sender.drain_batch()
+    finally:
+        await sender.stop()
+    # the first email went out and must not be sent again after the claim expires
+    assert len(inbox.messages) == 1
+    assert await statuses(engine) == [
+        OutboxStatus.status_sent,
+        OutboxStatus.status_sending,
+    ]
@@ -0,0 +1,162 @@
+"""Reservations and the day by day availability calendar."""
+
+import asyncio
+import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.core.migrations import backfill_availability
+from app.listings.models import Reservation
+from app.listings.selectors import AVAILABILITY_COLLECTION
+from app.listings.services import BOOKING_LOCK_COLLECTION, property_booking_lock
+from tests.utils import seed_properties
+
+pytestmark = pytest.mark.anyio
+
+API = settings.API_STR
+
+
+async def book(client, headers, slug: str, date_start: str, date_end: str):
+    response = await client.post(
+        f"{API}/feed/{slug}/reservations",
+        json={"reservation": {"date_start": date_start, "date_end": date_end}},
+        headers=headers,
+    )
+    assert response.status_code == 201, response.text
+    return response.json()["reservation_id"]
+
+
+async def occupied(client, slug: str) -> list:
+    response = await client.get(
+        f"{API}/feed/{slug}/availability",
+        params={"date_start": "2030-01-01", "date_end": "2030-01-04"},
+    )
+    assert response.status_code == 200, response.text
+    return response.json()["occupied"]
+
+
+async def test_parallel_conflicting_bookings(client, engine, make_user, auth_headers):
+    (property,) = await seed_properties(engine, await make_user(), 1)
+    # distinct overlapping ranges, only one of them can be booked
+    responses = await asyncio.gather(
+        *(
+            client.post(
+                f"{API}/feed/{property.slug}/reservations",
+                json={
+                    "reservation": {
+                        "date_start": f"2030-01-01T{hour:02}:00",
+                        "date_end": "2030-01-03T12:00",
+                    }
+                },
+                headers=auth_headers,
+            )
+            for hour in range(10)
+        )
+    )
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [201] + [409] * 9
+    assert await engine.count(Reservation) == 1
+
+
+async def test_parallel_bookings_on_different_dates(
+    client, engine, make_user, auth_headers
+):
+    (property,) = await seed_properties(engine, await make_user(), 1)
+    # they queue on the property lock but none of them conflicts
+    responses = await asyncio.gather(
+        *(
+            client.post(
+                f"{API}/feed/{property.slug}/reservations",
+                json={
+                    "reservation": {
+                        "date_start": f"2030-02-{day:02}T14:00",
+                        "date_end": f"2030-02-{day + 1:02}T10:00",
+                    }
+                },
+                headers=auth_headers,
+            )
+            for day in range(1, 21)
+        )
+    )
+    assert [response.status_code for response in responses] == [201] * 20
+    assert await engine.count(Reservation) == 20
+
+
+async def test_booking_lock_lost(engine):
+    async with property_booking_lock(engine, "property") as confirm:
+        await confirm()
+        # expired meanwhile and taken over by another request
+        await engine.database[BOOKING_LOCK_COLLECTION].update_one(
+            {"_id": "property"}, {"$set": {"owner": "other"}}
+        )
+        with pytest.raises(HTTPException) as error:
+            await confirm()
+        assert error.value.status_code == 503
+        assert error.value.headers == {"Retry-After": "1"}
+    # the lock of the other request is left alone
+    assert await engine.database[BOOKING_LOCK_COLLECTION].find_one(
+        {"_id": "property", "owner": "other"}
+    )
+
+
+async def test_cancel_keeps_shared_day(client, engine, make_user, auth_headers):
+    (property,) = await seed_properties(engine, await make_user(), 1)
+    morning = await book(
+        client, auth_headers, property.slug, "2030-01-01T08:00", "2030-01-01T12:00"
+    )
+    # the same day as the morning booking, checks out the next day
+    await book(
+        client, auth_headers, property.slug, "2030-01-01T13:00", "2030-01-02T12:00"
+    )
+    assert await occupied(client, property.slug) == [True, False, False]
+
+    response = await client.delete(
+        f"{API}/feed/{property.slug}/reservations/{morning}", headers=auth_headers
+    )
+    assert response.status_code == 204, response.text
+    assert await occupied(client, property.slug) == [True, False, False]
+
+
+async def test_backfill_availability(client, engine, make_user):
+    (property,) = await seed_properties(engine, await make_user(), 1)
+    # booked before the bitmaps existed
+    await engine.save(
+        Reservation(
+            property_id=str(property.id),
+            username="guest",
+            date_start=datetime.datetime(2030, 1, 2, 15),
+            date_end=datetime.datetime(2030, 1, 4, 11),
+        )
+    )
+    assert await occupied(client, property.slug) == [False, False, False]
+
+    assert await backfill_availability(engine) == {str(property.id): 1}
+    assert await occupied(client, property.slug) == [False, True, True]
+
+    # a property without reservations left loses its stale bitmaps
+    await engine.get_collection(Reservation).delete_many({})
+    assert await backfill_availability(engine) == {str(property.id): 0}
+    assert await engine.database[AVAILABILITY_COLLECTION].count_documents({}) == 0
+
+
+async def test_property_lists_upcoming_reservations(client, engine, make_user):
+    (property,) = await seed_properties(engine, await make_user(), 1)
+    now = datetime.datetime.utcnow()
+    for days in (-30, -3, 10):
+        await engine.save(
+            Reservation(
+                property_id=str(property.id),
+                username="guest",
+                date_start=now + datetime.timedelta(days=days),
+                date_end=now + datetime.timedelta(days=days + 5),
+            )
+        )
+    response = await client.get(f"{API}/feed/{property.slug}")
+    assert response.status_code == 200, response.text
+    # the stay that ended is left out, the current one comes first
+    starts = [
+        reservation["date_start"] for reservation in response.json()["reservations"]
+    ]
+    assert starts == sorted(starts) and len(starts) == 2
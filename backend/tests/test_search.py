@@ -0,0 +1,28 @@
+"""Full-text search on the listings."""
+
+import pytest
+
+from app.core.config import settings
+from tests.utils import seed_properties
+
+pytestmark = pytest.mark.anyio
+
+API = settings.API_STR
+
+
+async def test_search(client, engine, make_user):
+    await seed_properties(engine, await make_user(), 30)
+    response = await client.get(f"{API}/feed/search", params={"q": "12"})
+    assert response.status_code == 200, response.text
+    assert [card["slug"] for card in response.json()["properties"]] == ["listing-12"]
+
+
+@pytest.mark.parametrize(
+    "limit, status",
+    [(settings.SEARCH_MAX_LIMIT, 200), (settings.SEARCH_MAX_LIMIT + 1, 422)],
+)
+async def test_search_limit(client, engine, limit, status):
+    response = await client.get(
+        f"{API}/feed/search", params={"q": "garden", "limit": limit}
+    )
+    assert response.status_code == status, response.text
@@ -0,0 +1,55 @@
+"""Unique property slugs, under concurrent creates and on legacy data."""
+
+import asyncio
+import datetime
+
+import pytest
+from odmantic import ObjectId
+
+from app.core.config import settings
+from app.core.migrations import apply_indexes
+from app.listings.models import Property
+from tests.utils import property_payload, seed_properties
+
+pytestmark = pytest.mark.anyio
+
+API = settings.API_STR
+
+
+async def test_parallel_duplicate_titles(client, auth_headers):
+    responses = await asyncio.gather(
+        *(
+            client.post(
+                f"{API}/feed/",
+                json={"property": property_payload()},
+                headers=auth_headers,
+            )
+            for _ in range(50)
+        )
+    )
+    assert all(response.status_code == 201 for response in responses)
+    slugs = {response.json()["slug"] for response in responses}
+    assert len(slugs) == 50
+    assert "sunny-flat" in slugs
+
+
+async def test_dedupe_slugs_before_unique_index(engine, make_user):
+    (oldest,) = await seed_properties(engine, await make_user(), 1)
+    collection = engine.get_collection(Property)
+    # written before the slug index was unique
+    await collection.drop_index("slug_1")
+    for hours in (1, 2):
+        document = oldest.doc()
+        document["_id"] = ObjectId()
+        document["created_at"] = oldest.created_at + datetime.timedelta(hours=hours)
+        await collection.insert_one(document)
+    await collection.insert_one(
+        {**oldest.doc(), "_id": ObjectId(), "slug": "listing-0-2"}
+    )
+
+    applied = await apply_indexes(engine)
+
+    renamed = applied[Property.__collection__]["renamed_slugs"]
+    assert renamed == {"listing-0": ["listing-0-3", "listing-0-4"]}
+    assert (await collection.find_one({"_id": oldest.id}))["slug"] == "listing-0"
+    assert (await collection.index_information())["slug_1"]["unique"]
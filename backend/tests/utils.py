@@ -0,0 +1,129 @@
+"""Helpers shared by the tests and benchmarks"""
+
+import time
+import socket
+import asyncio
+import datetime
+import contextlib
+import statistics
+from typing import Any, Dict, List, AsyncIterator
+
+import httpx
+from odmantic import AIOEngine
+
+from app.auth.cache import user_cache
+from app.auth.models import UserBase
+from app.core.security import token_cache
+from app.listings.cache import count_cache, feed_cache, facet_cache, property_cache
+from app.listings.models import Address, Property, PropertyType
+
+TEST_PASSWORD = "secret123"
+
+
+def cookie_header(response: httpx.Response) -> Dict[str, str]:
+    """Cookie header replaying the Set-Cookie headers of a response"""
+    cookies = [
+        header.split(";", 1)[0] for header in response.headers.get_list("set-cookie")
+    ]
+    return {"Cookie": "; ".join(cookies)}
+
+
+def mongo_commands(response: httpx.Response) -> int:
+    """Mongo commands the request sent, counted by the metrics middleware"""
+    return int(response.headers["x-mongo-commands"])
+
+
+def property_payload(title: str = "Sunny flat", **fields: Any) -> Dict[str, Any]:
+    payload = {
+        "title": title,
+        "description": "Two rooms, close to the sea",
+        "price": 120_000,
+        "property_type": "Apartment",
+        "address": {"street": "1 Main street", "city": "Rabat"},
+    }
+    payload.update(fields)
+    return payload
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, Any]:
+    """Latency percentiles in milliseconds and throughput of a run"""
+    ordered = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return {
+        "requests": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": ordered[-1] * 1000,
+        "throughput_rps": len(ordered) / elapsed if elapsed else 0.0,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.asynccontextmanager
+async def loop_lag(interval: float = 0.005) -> AsyncIterator[List[float]]:
+    """Sample how late the event loop wakes a sleeping task, in seconds"""
+    lags: List[float] = []
+
+    async def probe() -> None:
+        while True:
+            started_at = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - started_at - interval)
+
+    task = asyncio.create_task(probe())
+    try:
+        yield lags
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+
+def clear_caches() -> None:
+    """Forget every per-worker cache, the next request hits Mongo"""
+    for cache in (
+        user_cache,
+        token_cache,
+        feed_cache,
+        property_cache,
+        count_cache,
+        facet_cache,
+    ):
+        cache.clear()
+
+
+async def seed_properties(
+    engine: AIOEngine, owner: UserBase, count: int, prefix: str = "listing"
+) -> List[Property]:
+    """Insert ``count`` properties, newest last, in batches of 1000"""
+    now = datetime.datetime.utcnow()
+    types = list(PropertyType)
+    properties = [
+        Property(
+            owner=owner,
+            title=f"{prefix} {index}",
+            slug=f"{prefix}-{index}",
+            description=f"Listing number {index} with a garden and a sea view",
+            price=50_000 + index * 10,
+            property_type=types[index % len(types)],
+            address=Address(street=f"{index} Main street", city=f"City {index % 20}"),
+            created_at=now - datetime.timedelta(seconds=count - index),
+        )
+        for index in range(count)
+    ]
+    collection = engine.get_collection(Property)
+    for start in range(0, count, 1000):
+        await collection.insert_many(
+            [property.doc() for property in properties[start : start + 1000]]
+        )
+    return properties